@@ -1,71 +1,155 @@
-const FLASK_API_PROCESS_URL = "http://127.0.0.1:5000/process_tweet";
+const FLASK_API_PROCESS_URL = "http://127.0.0.1:5000/process_tweets";
 
-// --- Listener for Messages from Content Script ---
-chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
-    // Expecting { action: "processTweetText", text: tweetText, statusId: tweetStatusId }
-    if (request.action === "processTweetText" && request.statusId) {
-        console.log(`Background received text for Status ID ${request.statusId}:`, request.text.substring(0, 50) + "...");
-        const tweetText = request.text;
-        const statusId = request.statusId; // Store the Status ID
+// --- Decision Cache ---
+// Bounded LRU cache of decisions by Status ID, shared by all tabs, so no tweet is sent twice.
+// A Map iterates in insertion order, so its first key is always the least recently used.
+const DECISION_CACHE_SIZE = 5000;
+const decisionCache = new Map(); // Map<string, 0|1>
+// Status IDs sent to the API and still waiting for a decision, with the tabs waiting on each
+const inFlightTabIds = new Map(); // Map<string, Set<number>>
 
-        // Acknowledge receipt immediately
-        sendResponse({ status: "Text and Status ID received by background, processing..." });
+function getCachedDecision(statusId) {
+    if (!decisionCache.has(statusId)) return undefined;
+    const decision = decisionCache.get(statusId);
+    // Move to the most recently used end
+    decisionCache.delete(statusId);
+    decisionCache.set(statusId, decision);
+    return decision;
+}
+
+function cacheDecision(statusId, decision) {
+    decisionCache.delete(statusId);
+    decisionCache.set(statusId, decision);
+    if (decisionCache.size > DECISION_CACHE_SIZE) {
+        decisionCache.delete(decisionCache.keys().next().value);
+    }
+}
+
+// --- Relaying Results to the Content Script ---
+function sendResult(tabId, statusId, decision, originalText) {
+    chrome.tabs.sendMessage(tabId, {
+        action: "tweetProcessingResult",
+        resultData: {
+            decision: decision,
+            original_text: originalText, // Keep for potential logging
+            statusId: statusId // Pass the Status ID back
+        }
+    }, (response) => {
+        if (chrome.runtime.lastError) {
+            console.warn(`Could not send processing result back to content script (Status ID ${statusId}):`, chrome.runtime.lastError.message);
+        }
+    });
+}
 
-        // Call the Flask API (Flask doesn't need the Status ID)
-        fetch(FLASK_API_PROCESS_URL, {
+function sendError(tabId, statusId, message) {
+    chrome.tabs.sendMessage(tabId, {
+        action: "tweetProcessingResult",
+        error: `Error processing tweet: ${message}`,
+        statusId: statusId // Include Status ID in error message
+    }, (response) => {
+        if (chrome.runtime.lastError) {
+            console.warn(`Could not send processing error back to content script (Status ID ${statusId}):`, chrome.runtime.lastError.message);
+        }
+    });
+}
+
+/**
+ * Sends a batch of tweets to the bulk endpoint and relays each decision as soon as its
+ * line of the newline-delimited JSON response arrives.
+ * @param {Array<{statusId: string, text: string}>} tweets
+ */
+async function processBatch(tweets) {
+    const textsByStatusId = new Map(tweets.map(tweet => [tweet.statusId, tweet.text]));
+    const pending = new Set(textsByStatusId.keys());
+
+    try {
+        const response = await fetch(FLASK_API_PROCESS_URL, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ tweet_text: tweetText }) // Only send text to Flask
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP error! Status: ${response.status} for Status ID ${statusId}`);
-            }
-            return response.json(); // Expecting { decision: 0|1, original_text: "..." }
-        })
-        .then(data => {
-            console.log(`Received decision ${data.decision} from Flask API for Status ID ${statusId}`);
-            if (data && typeof data.decision !== 'undefined' && typeof data.original_text !== 'undefined') {
-                // Send the decision data AND the Status ID back to the content script
-                if (sender.tab && sender.tab.id) {
-                    chrome.tabs.sendMessage(sender.tab.id, {
-                        action: "tweetProcessingResult",
-                        resultData: {
-                            decision: data.decision,
-                            original_text: data.original_text, // Keep for potential logging
-                            statusId: statusId // Pass the Status ID back
-                        }
-                    }, (response) => {
-                         if (chrome.runtime.lastError) {
-                            console.warn(`Could not send processing result back to content script (Status ID ${statusId}):`, chrome.runtime.lastError.message);
-                         } else {
-                            // console.log(`Content script acknowledged result for Status ID ${statusId}:`, response);
-                         }
-                    });
+            body: JSON.stringify(tweets.map(tweet => ({ id: tweet.statusId, tweet_text: tweet.text })))
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! Status: ${response.status}`);
+        }
+
+        // Expecting one { id: statusId, decision: 0|1 } or { id: statusId, error: "..." } per line
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = "";
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+
+            const lines = buffered.split("\n");
+            buffered = lines.pop(); // Keep any incomplete last line
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const data = JSON.parse(line);
+                const statusId = data.id;
+                const tabIds = inFlightTabIds.get(statusId) || new Set();
+                pending.delete(statusId);
+                inFlightTabIds.delete(statusId);
+
+                if (typeof data.decision !== 'undefined') {
+                    console.log(`Received decision ${data.decision} from Flask API for Status ID ${statusId}`);
+                    cacheDecision(statusId, data.decision);
+                    tabIds.forEach(tabId => sendResult(tabId, statusId, data.decision, textsByStatusId.get(statusId)));
                 } else {
-                     console.error("Sender tab ID not found when trying to send processing result back.");
+                    tabIds.forEach(tabId => sendError(tabId, statusId, data.error));
                 }
+            }
+        }
+    } catch (error) {
+        console.error(`Error calling Flask API for ${pending.size} tweets:`, error);
+    }
+
+    // Anything left unanswered failed; let the content script retry it.
+    pending.forEach(statusId => {
+        const tabIds = inFlightTabIds.get(statusId) || new Set();
+        inFlightTabIds.delete(statusId);
+        tabIds.forEach(tabId => sendError(tabId, statusId, "No decision received"));
+    });
+}
+
+// --- Listener for Messages from Content Script ---
+chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
+    // Expecting { action: "processTweetBatch", tweets: [{ statusId, text }, ...] }, visible tweets first
+    if (request.action === "processTweetBatch" && Array.isArray(request.tweets)) {
+        if (!sender.tab || !sender.tab.id) {
+            console.error("Sender tab ID not found for tweet batch.");
+            sendResponse({ status: "Error: Missing tab ID" });
+            return true;
+        }
+        const tabId = sender.tab.id;
+
+        // Answer cached tweets straight away, and only wait on ones another batch already sent.
+        const toSend = [];
+        request.tweets.forEach(tweet => {
+            const decision = getCachedDecision(tweet.statusId);
+            if (decision !== undefined) {
+                sendResult(tabId, tweet.statusId, decision, tweet.text);
+            } else if (inFlightTabIds.has(tweet.statusId)) {
+                inFlightTabIds.get(tweet.statusId).add(tabId);
             } else {
-                 console.error(`Decision or original text not found in API response for Status ID ${statusId}:`, data);
+                inFlightTabIds.set(tweet.statusId, new Set([tabId]));
+                toSend.push(tweet);
             }
-        })
-        .catch(error => {
-            console.error(`Error calling Flask API for Status ID ${statusId}:`, error);
-            // Inform the content script about the error, including the Status ID
-             if (sender.tab && sender.tab.id) {
-                 chrome.tabs.sendMessage(sender.tab.id, {
-                     action: "tweetProcessingResult",
-                     error: `Error processing tweet: ${error.message}`,
-                     statusId: statusId // Include Status ID in error message
-                 });
-             }
         });
 
-        // Return true to indicate you wish to send a response asynchronously
+        console.log(`Background received ${request.tweets.length} tweets, sending ${toSend.length} to the API.`);
+
+        // Acknowledge receipt immediately
+        sendResponse({ status: "Batch received by background, processing..." });
+
+        if (toSend.length > 0) {
+            processBatch(toSend);
+        }
+
         return true;
     }
 });
 
-console.log("Tweet Random Decision Background Script Loaded (Status ID Relay Mode).");
+console.log("Tweet Classifier Background Script Loaded (Batched Status ID Relay Mode).");
@@ -4,6 +4,8 @@
  * Remembers decisions and highlights/re-highlights if decision is 1.
  * Logs the decision to the console.
  * Triggered by debounced scroll/mutation events.
+ * New tweets are queued and sent in small time-windowed batches, tweets in the viewport
+ * first; queued tweets that scroll away before their batch is sent are dropped.
  */
 console.log("Tweet Random Highlighter Content Script Loaded (Scroll-Based / Persistent Off-Screen Mode).");
 
@@ -17,6 +19,15 @@ const highlightedElementsByStatusID = new Map(); // Map<string, HTMLElement>
 let debounceTimer = null;
 const DEBOUNCE_DELAY = 100; // ms delay
 
+// --- Batching ---
+// Tweets found but not sent yet (Map: statusId -> { element, text })
+const pendingTweets = new Map(); // Map<string, {element: HTMLElement, text: string}>
+let batchTimer = null;
+const BATCH_WINDOW = 150; // ms to collect tweets before sending a batch
+const MAX_BATCH_SIZE = 16; // tweets per batch; the rest wait for the next window
+// Tweets up to this many viewport heights above or below the screen are queued ahead of time
+const PREFETCH_VIEWPORTS = 0.5;
+
 
 // --- Highlight Management ---
 /**
@@ -65,14 +76,29 @@ function applyHighlightByStatusId(element, statusId) {
 }
 
 // --- Tweet Finding/Text/ID Extraction ---
-function findVisibleTweetElements() {
+/**
+ * Vertical distance in pixels from a tweet element to the viewport, 0 if any of it is on screen.
+ * @param {HTMLElement} tweetElement
+ * @returns {number}
+ */
+function distanceFromViewport(tweetElement) {
+    const rect = tweetElement.getBoundingClientRect();
+    if (rect.bottom <= 0) return -rect.bottom;
+    if (rect.top >= window.innerHeight) return rect.top - window.innerHeight;
+    return 0;
+}
+
+/**
+ * Finds tweets on screen or within the given margin (in pixels) above or below it.
+ * @param {number} margin
+ * @returns {HTMLElement[]}
+ */
+function findVisibleTweetElements(margin = 0) {
     const tweetSelector = 'article[data-testid="tweet"]';
     const allTweets = document.querySelectorAll(tweetSelector);
     const visibleTweets = [];
     allTweets.forEach(tweet => {
-        const rect = tweet.getBoundingClientRect();
-        const isVerticallyVisible = rect.top < window.innerHeight && rect.bottom > 0;
-        if (isVerticallyVisible) {
+        if (distanceFromViewport(tweet) <= margin) {
             visibleTweets.push(tweet);
         }
     });
@@ -138,14 +164,78 @@ function findTweetElementByStatusId(statusId) {
 }
 
 
+// --- Batch Sending ---
+/**
+ * Queues a new tweet for the next batch, starting the batch window if none is open.
+ * @param {string} statusId
+ * @param {HTMLElement} tweetElement
+ * @param {string} tweetText
+ */
+function enqueueTweet(statusId, tweetElement, tweetText) {
+    pendingTweets.set(statusId, { element: tweetElement, text: tweetText });
+    if (!batchTimer) {
+        batchTimer = setTimeout(sendPendingBatch, BATCH_WINDOW);
+    }
+}
+
+/**
+ * Sends up to MAX_BATCH_SIZE queued tweets to the background script, nearest to the
+ * viewport first. Queued tweets whose element is gone or has scrolled out of the
+ * prefetch margin are dropped; they are queued again if they come back.
+ */
+function sendPendingBatch() {
+    batchTimer = null;
+    const margin = PREFETCH_VIEWPORTS * window.innerHeight;
+
+    const candidates = [];
+    pendingTweets.forEach(({ element, text }, statusId) => {
+        // Twitter recycles tweet elements, so check the element still shows this tweet
+        if (!document.contains(element) || getTweetStatusId(element) !== statusId) {
+            pendingTweets.delete(statusId);
+            return;
+        }
+        const distance = distanceFromViewport(element);
+        if (distance > margin) {
+            pendingTweets.delete(statusId);
+            return;
+        }
+        candidates.push({ statusId, text, distance });
+    });
+
+    // Visible tweets (distance 0) first, then the nearest; sort is stable, so DOM order breaks ties
+    candidates.sort((a, b) => a.distance - b.distance);
+    const batch = candidates.slice(0, MAX_BATCH_SIZE);
+    if (batch.length === 0) return;
+
+    batch.forEach(({ statusId }) => {
+        pendingTweets.delete(statusId);
+        processedStatusIds.add(statusId); // Mark Status ID as sent
+    });
+
+    // Send the texts AND the Status IDs to the background script
+    const tweets = batch.map(({ statusId, text }) => ({ statusId, text }));
+    chrome.runtime.sendMessage({ action: "processTweetBatch", tweets: tweets }, (response) => {
+        if (chrome.runtime.lastError) {
+            console.warn(`Error sending batch of ${tweets.length} tweets:`, chrome.runtime.lastError.message);
+            tweets.forEach(({ statusId }) => processedStatusIds.delete(statusId)); // Allow retry
+        }
+    });
+
+    // Leave the rest for the next window
+    if (pendingTweets.size > 0) {
+        batchTimer = setTimeout(sendPendingBatch, BATCH_WINDOW);
+    }
+}
+
+
 // --- Core Logic ---
 /**
- * Finds all visible tweets. Uses Status ID for tracking.
+ * Finds all visible and nearly visible tweets. Uses Status ID for tracking.
  * If a decision is known, applies it using inline styles.
- * If the tweet is new (by Status ID), sends it for processing.
+ * If the tweet is new (by Status ID), queues it for the next batch.
  */
 function processVisibleTweets() {
-    const visibleTweets = findVisibleTweetElements();
+    const visibleTweets = findVisibleTweetElements(PREFETCH_VIEWPORTS * window.innerHeight);
     // const currentlyVisibleStatusIds = new Set(); // No longer needed for cleanup loop
 
     visibleTweets.forEach(tweetElement => {
@@ -165,26 +255,16 @@ function processVisibleTweets() {
                     removeHighlightByStatusId(statusId);
                 }
             }
-            // 2. Else, check if it's already been sent (waiting for result)
-            else if (processedStatusIds.has(statusId)) {
-                // Waiting for result. Do nothing here.
+            // 2. Else, check if it's already been sent (waiting for result) or queued
+            else if (processedStatusIds.has(statusId) || pendingTweets.has(statusId)) {
+                // Waiting for result or batch. Do nothing here.
             }
             // 3. Else, it's a new tweet (by Status ID) we haven't processed yet
             else {
                  const tweetText = getTweetText(tweetElement);
                  if (tweetText) { // Only process if we have text
-                    // console.log(`Processing new tweet with Status ID ${statusId}:`, tweetText.substring(0, 100) + "...");
-                    processedStatusIds.add(statusId); // Mark Status ID as sent
-
-                    // Send the found text AND the Status ID to the background script
-                    chrome.runtime.sendMessage({ action: "processTweetText", text: tweetText, statusId: statusId }, (response) => {
-                         if (chrome.runtime.lastError) {
-                            console.warn(`Error sending message for Status ID ${statusId}:`, chrome.runtime.lastError.message);
-                            processedStatusIds.delete(statusId); // Allow retry
-                        } else {
-                            // console.log(`Background ack send for Status ID ${statusId}:`, response);
-                        }
-                    });
+                    // console.log(`Queueing new tweet with Status ID ${statusId}:`, tweetText.substring(0, 100) + "...");
+                    enqueueTweet(statusId, tweetElement, tweetText);
                  }
             }
         }
@@ -287,7 +367,9 @@ window.addEventListener('unload', () => {
     window.removeEventListener('scroll', debouncedCheck);
     if (mutationObserver) mutationObserver.disconnect();
     clearTimeout(debounceTimer);
+    clearTimeout(batchTimer);
     // Clear state on unload
+    pendingTweets.clear();
     processedStatusIds.clear();
     tweetDecisions.clear();
     // Remove any remaining highlights on unload
@@ -1,3 +1,4 @@
+import os
 from argparse import ArgumentParser
 
 parser = ArgumentParser()
@@ -43,5 +44,350 @@ parser.add_argument(
     default=None,
     help="Text to provide to classifier when running classify.py"
 )
+parser.add_argument(
+    "--input_path",
+    type=str,
+    default=None,
+    help="CSV, JSONL or Parquet file for classify.py to classify in bulk instead of --text.",
+)
+parser.add_argument(
+    "--output_path",
+    type=str,
+    default="classified.csv",
+    help="CSV that bulk classification appends id, probability and decision rows to.",
+)
+parser.add_argument(
+    "--checkpoint_path",
+    type=str,
+    default=None,
+    help="Where bulk classification records its progress (defaults to <output_path>.checkpoint).",
+)
+parser.add_argument("--text_column", type=str, default="text", help="Column of the input file holding the text.")
+parser.add_argument(
+    "--id_column",
+    type=str,
+    default=None,
+    help="Column of the input file to copy to the output as the id (defaults to the row number).",
+)
+parser.add_argument("--chunk_size", type=int, default=10000, help="Rows read and written at a time in bulk mode.")
+parser.add_argument(
+    "--preprocess_workers",
+    type=int,
+    default=0,
+    help="Processes preprocessing text in bulk mode (0 uses one per core).",
+)
+parser.add_argument(
+    "--preprocess_batch_size",
+    type=int,
+    default=256,
+    help="Texts each bulk preprocessing process disambiguates together, sharing MLM batches.",
+)
+parser.add_argument(
+    "--label_column", type=str, default="label", help="Column of the input file holding the label in build_dataset.py."
+)
+parser.add_argument(
+    "--shard_dir", type=str, default="./data/shards", help="Where build_dataset.py writes its output shards."
+)
+parser.add_argument("--shard_size", type=int, default=1000000, help="Rows per build_dataset.py output shard.")
+parser.add_argument(
+    "--max_batch_size",
+    type=int,
+    default=32,
+    help="Maximum number of queued texts classified together by the server.",
+)
+parser.add_argument(
+    "--max_batch_wait_ms",
+    type=float,
+    default=5,
+    help="Maximum time in milliseconds the server waits to fill a batch.",
+)
+parser.add_argument(
+    "--contraction_beam_width",
+    type=int,
+    default=4,
+    help="Number of partial contraction expansions kept while preprocessing.",
+)
+parser.add_argument(
+    "--contraction_scoring",
+    type=str,
+    default="sentence",
+    choices=["sentence", "local"],
+    help="Score contraction expansions over the whole sentence or only around each contraction.",
+)
+parser.add_argument(
+    "--contraction_context_window",
+    type=int,
+    default=5,
+    help="Words either side of a contraction used by local contraction scoring.",
+)
+parser.add_argument(
+    "--cache_size",
+    type=int,
+    default=10000,
+    help="Maximum number of results kept in the server's in-memory cache.",
+)
+parser.add_argument(
+    "--cache_ttl",
+    type=float,
+    default=3600,
+    help="Seconds a cached result stays valid (0 keeps results forever).",
+)
+parser.add_argument(
+    "--cache_path",
+    type=str,
+    default=None,
+    help="Optional SQLite file used to persist cached results across restarts.",
+)
+parser.add_argument(
+    "--bucket_by_length",
+    action="store_true",
+    help="Batch examples of similar length together and pad each batch only to its longest sequence.",
+)
+parser.add_argument(
+    "--bf16",
+    action="store_true",
+    help="Train under bfloat16 autocast. Evaluation always runs in fp32.",
+)
+parser.add_argument(
+    "--compile",
+    action="store_true",
+    help="Train a torch.compile'd version of the model. Evaluation always runs the uncompiled model.",
+)
+parser.add_argument(
+    "--check_parity",
+    action="store_true",
+    help="""Also train the same model in plain fp32, without --bf16, --compile and --grad_accum_steps,
+    into models/<output_dir>-fp32/, and compare the two models' validation accuracy.""",
+)
+parser.add_argument(
+    "--distributed",
+    action="store_true",
+    help="Train data-parallel over the gloo backend, one process per rank. Launch train.py with torchrun.",
+)
+parser.add_argument(
+    "--grad_accum_steps",
+    type=int,
+    default=1,
+    help="Number of batches whose gradients are summed before each optimizer step.",
+)
+parser.add_argument(
+    "--early_exit",
+    action="store_true",
+    help="Train BERT with a classification head after every encoder layer, so inference can stop early. Saved in the model's config.",
+)
+parser.add_argument(
+    "--exit_threshold",
+    type=float,
+    default=0.9,
+    help="Probability, either way, at which an early-exit model stops running further layers for a tweet.",
+)
+parser.add_argument(
+    "--teacher_model_name_or_path",
+    type=str,
+    default=None,
+    help="Trained BERT classifier to distill into the model being trained. Distillation is off if not given.",
+)
+parser.add_argument(
+    "--student_layers",
+    type=int,
+    default=None,
+    help="Distill into a copy of the teacher cut down to this many encoder layers, instead of --model_name_or_path.",
+)
+parser.add_argument(
+    "--overwrite_output_dir",
+    action="store_true",
+    help="Let --student_layers build its student in a models/<output_dir>/ that already holds a model.",
+)
+parser.add_argument(
+    "--distill_alpha",
+    type=float,
+    default=0.5,
+    help="Weight of the loss against the teacher's soft labels; the hard label loss gets the rest.",
+)
+parser.add_argument(
+    "--distill_temperature",
+    type=float,
+    default=2.0,
+    help="Temperature both the teacher's and the student's logits are divided by in the soft loss.",
+)
+parser.add_argument(
+    "--latency_samples",
+    type=int,
+    default=200,
+    help="Number of validation tweets the teacher and student are timed on after distillation.",
+)
+parser.add_argument(
+    "--sweep_space",
+    type=str,
+    default=None,
+    help="""JSON, or a JSON file, mapping train.py arguments to lists of values for sweep.py,
+    e.g. '{"lr": [2e-5, 5e-5], "batch_size": [16, 32]}'. In random mode a value may also be
+    {"low": ..., "high": ..., "log": true} to sample from a range.""",
+)
+parser.add_argument(
+    "--sweep_mode",
+    type=str,
+    default="grid",
+    choices=["grid", "random"],
+    help="Try every combination of the sweep space, or --sweep_trials random samples of it.",
+)
+parser.add_argument("--sweep_trials", type=int, default=10, help="Number of trials in a random sweep.")
+parser.add_argument("--sweep_seed", type=int, default=0, help="Seed for sampling a random sweep.")
+parser.add_argument(
+    "--sweep_workers",
+    type=int,
+    default=2,
+    help="Number of trials trained at once; the cores are split evenly between them.",
+)
+parser.add_argument(
+    "--sweep_prune_margin",
+    type=float,
+    default=0.02,
+    help="Stop a trial after its first epoch if its accuracy is this far below the best first epoch so far.",
+)
+parser.add_argument(
+    "--sweep_output", type=str, default="sweep_results.csv", help="CSV that sweep.py writes a row per trial to."
+)
+parser.add_argument(
+    "--inference_backend",
+    type=str,
+    default="eager",
+    choices=["eager", "int8", "onnx"],
+    help="Run inference with fp32 PyTorch, dynamically int8-quantized PyTorch, or an exported ONNX model on ONNX Runtime.",
+)
+parser.add_argument(
+    "--model_names_or_paths",
+    type=str,
+    nargs="+",
+    default=None,
+    help="Several trained models for evaluate.py to compare on the validation split in one pass.",
+)
+parser.add_argument(
+    "--logits_dir",
+    type=str,
+    default="./data/logits",
+    help="Where evaluate.py stores each compared model's validation logits and writes the metrics computed from them.",
+)
+parser.add_argument(
+    "--from_logits",
+    action="store_true",
+    help="Recompute evaluate.py's comparison from the logits already in --logits_dir, without running any model.",
+)
+parser.add_argument(
+    "--num_thresholds",
+    type=int,
+    default=99,
+    help="Number of evenly spaced decision thresholds between 0 and 1 that evaluate.py reports metrics at.",
+)
+parser.add_argument(
+    "--parity_samples",
+    type=int,
+    default=2000,
+    help="Number of dataset rows export.py evaluates each backend on (0 uses all rows).",
+)
+parser.add_argument(
+    "--scoring_model_name_or_path",
+    type=str,
+    default="bert-base-uncased",
+    help="Masked language model used to choose between contraction expansions.",
+)
+parser.add_argument(
+    "--offline",
+    action="store_true",
+    help="Only load models and tokenizers from local files, never from the network.",
+)
+parser.add_argument(
+    "--serve_mode",
+    type=str,
+    default="dev",
+    choices=["dev", "production"],
+    help="Serve with Flask's development server or with waitress's pool of request threads.",
+)
+parser.add_argument(
+    "--server_threads",
+    type=int,
+    default=32,
+    help="Number of requests the production server handles at once; requests beyond it wait for a thread.",
+)
+parser.add_argument("--host", type=str, default="0.0.0.0", help="Address the server listens on.")
+parser.add_argument("--port", type=int, default=5000, help="Port the server listens on.")
+parser.add_argument(
+    "--max_queue_size",
+    type=int,
+    default=256,
+    help="Maximum number of requests waiting for the model before the server answers 503.",
+)
+parser.add_argument(
+    "--model_threads",
+    type=int,
+    default=2,
+    help="Number of server threads dedicated to contraction disambiguation.",
+)
+parser.add_argument(
+    "--request_timeout_ms",
+    type=float,
+    default=5000,
+    help="Deadline for a /process_tweet request; expired requests are dropped before reaching the model (0 disables).",
+)
+parser.add_argument(
+    "--log_sample_rate",
+    type=float,
+    default=1.0,
+    help="Fraction of successful requests the server logs; errors are always logged.",
+)
+parser.add_argument(
+    "--inference_workers",
+    type=int,
+    default=0,
+    help="Number of forked server processes sharing the model weights (0 runs inference in the server process).",
+)
+parser.add_argument(
+    "--enable_profiler",
+    action="store_true",
+    help="Serve /debug/profile?seconds=N, which samples the server's hot paths on demand.",
+)
+parser.add_argument(
+    "--bench",
+    type=str,
+    default="all",
+    choices=["micro", "load", "all"],
+    help="Which benchmarks benchmark.py runs.",
+)
+parser.add_argument(
+    "--bench_model_types",
+    type=str,
+    nargs="+",
+    default=["bert", "albert", "distilbert"],
+    choices=["bert", "albert", "distilbert"],
+    help="Tiny randomly-initialized classifier architectures to benchmark.",
+)
+parser.add_argument("--bench_samples", type=int, default=200, help="Number of synthetic tweets.")
+parser.add_argument("--bench_min_words", type=int, default=5, help="Minimum words per synthetic tweet.")
+parser.add_argument("--bench_max_words", type=int, default=40, help="Maximum words per synthetic tweet.")
+parser.add_argument(
+    "--bench_contraction_rate", type=float, default=0.1, help="Fraction of synthetic words that are ambiguous contractions."
+)
+parser.add_argument(
+    "--bench_emoji_rate", type=float, default=0.05, help="Fraction of synthetic words that are emojis or emoticons."
+)
+parser.add_argument(
+    "--bench_url_rate", type=float, default=0.05, help="Fraction of synthetic words that are URLs or mentions."
+)
+parser.add_argument("--bench_seed", type=int, default=0, help="Seed for synthetic tweets and model weights.")
+parser.add_argument("--bench_rate", type=float, default=20, help="Target requests per second for the load test.")
+parser.add_argument("--bench_duration", type=float, default=10, help="Load test duration in seconds.")
+parser.add_argument(
+    "--bench_concurrency", type=int, default=64, help="Maximum requests the load test has outstanding at once."
+)
+parser.add_argument(
+    "--bench_output", type=str, default="bench_results.json", help="Where benchmark.py writes its JSON results."
+)
+
+args = parser.parse_args()
+
 
-args = parser.parse_args()
\ No newline at end of file
+def apply_offline(args):
+    """With --offline, never reach out to the Hugging Face Hub; models must already be on disk.
+    Call before transformers is imported, which reads the setting once."""
+    if args.offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"
@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from operator import itemgetter
+from queue import Queue, Empty, Full
+
+
+class Overloaded(Exception):
+    """Raised when a bounded queue is full and new work is refused."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work is done."""
+
+
+# Waits for a future, giving up once the deadline (a time.monotonic() value, or None) has passed.
+def wait_until(future, deadline):
+    timeout = None if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise DeadlineExceeded()
+
+
+def collect_batch(queue, max_batch_size, max_wait, deadline_of):
+    """
+    Waits for the next queued item, then keeps taking items until max_batch_size items
+    are taken or max_wait seconds have passed. Returns the batch split into the items
+    still worth running and those whose deadline (deadline_of(item), a time.monotonic()
+    value or None) has passed, since nobody is waiting for those any more.
+    """
+    batch = [queue.get()]
+    stop = time.monotonic() + max_wait
+
+    while len(batch) < max_batch_size:
+        remaining = stop - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(queue.get(timeout=remaining))
+        except Empty:
+            break
+
+    now = time.monotonic()
+    live, expired = [], []
+    for item in batch:
+        deadline = deadline_of(item)
+        (expired if deadline is not None and deadline < now else live).append(item)
+    return live, expired
+
+
+class MicroBatcher:
+    """
+    Queues texts from concurrent requests and classifies them together.
+
+    A single worker thread waits for the first queued text, then keeps collecting
+    until either max_batch_size texts are queued or max_wait_ms has passed, and runs
+    one padded forward pass over the whole batch. Each caller gets back its own decision.
+
+    At most max_queue_size texts can wait (0 means unbounded); further texts are refused
+    with Overloaded. Texts whose deadline has passed are dropped before the forward pass.
+    """
+
+    def __init__(self, classifier, max_batch_size=32, max_wait_ms=5, max_queue_size=0):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.queue = Queue(maxsize=max_queue_size)
+
+        # Start the worker that runs the forward passes.
+        self.worker = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+        self.worker.start()
+
+    # Queues a text and returns a future that resolves to its decision.
+    def submit(self, text, deadline=None):
+        future = Future()
+        try:
+            self.queue.put_nowait((text, deadline, future))
+        except Full:
+            raise Overloaded()
+        return future
+
+    # Queues a text and blocks until its decision is available.
+    def classify(self, text, deadline=None):
+        return wait_until(self.submit(text, deadline), deadline)
+
+    # Number of texts waiting for a forward pass.
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            batch, expired = collect_batch(self.queue, self.max_batch_size, self.max_wait, itemgetter(1))
+            for _, _, future in expired:
+                future.set_exception(DeadlineExceeded())
+
+            if not batch:
+                continue
+
+            texts = [text for text, _, _ in batch]
+
+            try:
+                decisions = self.classifier.classify_sentiment_batch(texts)
+            except Exception as e:
+                # Fail every request in the batch rather than killing the worker.
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, future), decision in zip(batch, decisions):
+                future.set_result(decision)
@@ -0,0 +1,305 @@
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import transformers
+from transformers import (
+    AlbertConfig,
+    BertConfig,
+    BertForMaskedLM,
+    BertTokenizerFast,
+    DistilBertConfig,
+)
+
+from arguments import args
+from model import BertForSentimentClassification, AlbertForSentimentClassification, DistilBertForSentimentClassification
+from preprocessor import Preprocessor, load_contractions
+
+FILLER_WORDS = (
+    "the a this that is was so very really just what why how who people time day "
+    "good bad great terrible love hate think know see look make going get got "
+    "tweet post news game life world today tonight never always everyone nobody"
+).split()
+EMOJIS = ["😂", "🔥", "😡", "👍", "💀", "🙄"]
+EMOTICONS = [":)", ":(", ";)", ":D", ":P"]
+
+
+def generate_tweets(n, min_words, max_words, contraction_rate, emoji_rate, url_rate, seed=0):
+    """
+    Generates n synthetic tweets. Each word slot is an ambiguous contraction with
+    probability contraction_rate, an emoji or emoticon with probability emoji_rate,
+    a URL or mention with probability url_rate, and a filler word otherwise.
+    """
+    rng = random.Random(seed)
+    contractions, _ = load_contractions()
+    ambiguous = sorted(word for word, options in contractions.items() if len(options) > 1)
+
+    tweets = []
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(min_words, max_words)):
+            roll = rng.random()
+            if roll < contraction_rate:
+                words.append(rng.choice(ambiguous))
+            elif roll < contraction_rate + emoji_rate:
+                words.append(rng.choice(EMOJIS + EMOTICONS))
+            elif roll < contraction_rate + emoji_rate + url_rate:
+                words.append(rng.choice([f"https://t.co/{rng.getrandbits(32):x}", f"@user{rng.randint(0, 999)}"]))
+            else:
+                words.append(rng.choice(FILLER_WORDS))
+        tweets.append(" ".join(words))
+    return tweets
+
+
+def build_tiny_models(directory, model_type, seed=0):
+    """
+    Saves a tiny randomly-initialized classifier of the given type and a tiny BERT MLM,
+    with a word-level vocabulary covering the filler words and contraction expansions,
+    so benchmarks run offline without downloaded weights. Returns both paths.
+    """
+    torch.manual_seed(seed)
+
+    contractions, _ = load_contractions()
+    words = set(FILLER_WORDS)
+    for options in contractions.values():
+        for option in options:
+            words.update(re.findall(r"[a-z]+", option.lower()))
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(words)
+    vocab_path = os.path.join(directory, "vocab.txt")
+    with open(vocab_path, "w") as outfile:
+        outfile.write("\n".join(vocab))
+    tokenizer = BertTokenizerFast(vocab_path, do_lower_case=True, model_max_length=128)
+
+    size = dict(vocab_size=len(vocab), max_position_embeddings=128)
+    if model_type == "bert":
+        model = BertForSentimentClassification(BertConfig(
+            hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64, **size
+        ))
+    elif model_type == "albert":
+        model = AlbertForSentimentClassification(AlbertConfig(
+            embedding_size=16, hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64, **size
+        ))
+    elif model_type == "distilbert":
+        model = DistilBertForSentimentClassification(DistilBertConfig(
+            dim=32, n_layers=2, n_heads=2, hidden_dim=64, **size
+        ))
+    else:
+        raise ValueError("This transformer model is not supported yet.")
+
+    classifier_path = os.path.join(directory, f"{model_type}-classifier")
+    model.save_pretrained(classifier_path)
+    tokenizer.save_pretrained(classifier_path)
+
+    mlm_path = os.path.join(directory, "mlm")
+    BertForMaskedLM(BertConfig(
+        hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64, **size
+    )).save_pretrained(mlm_path)
+    tokenizer.save_pretrained(mlm_path)
+
+    return classifier_path, mlm_path
+
+
+# Summarizes per-call latencies in milliseconds.
+def summarize(latencies, elapsed):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_per_sec": len(latencies) / elapsed,
+    }
+
+
+# Calls fn on every input and summarizes the per-call latencies.
+def time_calls(fn, inputs):
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        call_start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_micro_benchmarks(tweets, classifier_path, mlm_path):
+    # Imported here so the classifier picks up the benchmark's parsed arguments.
+    from classifier import Classifier
+
+    preprocessor = Preprocessor(
+        beam_width=args.contraction_beam_width,
+        scoring=args.contraction_scoring,
+        context_window=args.contraction_context_window,
+        scoring_model_name_or_path=mlm_path,
+        local_files_only=True,
+    )
+    preprocessor.load_scoring_model()
+
+    args.model_name_or_path = classifier_path
+    classifier = Classifier(for_training=False, args=args)
+
+    cleaned = [preprocessor.clean_text(tweet) for tweet in tweets]
+    # The exhaustive product is exponential, so only time it on tweets where it stays small.
+    small = [text for text in cleaned if len(preprocessor.expand_contractions(text)) <= 64]
+    candidates = [preprocessor.expand_contractions(text) for text in small]
+    preprocessed = [preprocessor.disambiguate(text) for text in cleaned]
+
+    results = {
+        "clean_text": time_calls(preprocessor.clean_text, tweets),
+        "expand_contractions": time_calls(preprocessor.expand_contractions, small),
+        "select_best_expansion": time_calls(preprocessor.select_best_expansion, candidates),
+        "search_best_expansion": time_calls(
+            preprocessor.search_best_expansion, [preprocessor.expansion_options(text) for text in cleaned]
+        ),
+        "classify_sentiment": time_calls(classifier.classify_sentiment, preprocessed),
+    }
+
+    batches = [preprocessed[i:i + args.max_batch_size] for i in range(0, len(preprocessed), args.max_batch_size)]
+    results["classify_sentiment_batch"] = time_calls(classifier.classify_sentiment_batch, batches)
+    results["classify_sentiment_batch"]["batch_size"] = args.max_batch_size
+
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Starts main.py on the tiny models and waits until it answers.
+def start_server(classifier_path, mlm_path, port):
+    server = subprocess.Popen(
+        [
+            sys.executable, "main.py",
+            "--model_name_or_path", classifier_path,
+            "--scoring_model_name_or_path", mlm_path,
+            "--offline",
+            "--serve_mode", "production",
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "--log_sample_rate", "0",
+            "--cache_size", "0",
+            "--max_batch_size", str(args.max_batch_size),
+            "--max_batch_wait_ms", str(args.max_batch_wait_ms),
+            "--inference_backend", args.inference_backend,
+            "--inference_workers", str(args.inference_workers),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    for _ in range(600):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("Benchmark server exited during startup.")
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError("Benchmark server did not start.")
+
+
+def run_load_test(tweets, url, rate, duration):
+    """
+    Sends POST requests to url at a fixed rate (open loop) for duration seconds.
+    Latency is measured from each request's scheduled send time, so a server that
+    falls behind is not hidden by the load generator slowing down with it.
+    """
+    num_requests = int(rate * duration)
+    start = time.perf_counter() + 0.1
+
+    def send(i):
+        scheduled = start + i / rate
+        time.sleep(max(0, scheduled - time.perf_counter()))
+
+        body = json.dumps({"tweet_text": tweets[i % len(tweets)]}).encode("utf-8")
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                ok = response.status == 200
+        except OSError:
+            ok = False
+        return time.perf_counter() - scheduled, ok
+
+    with ThreadPoolExecutor(max_workers=args.bench_concurrency) as executor:
+        outcomes = list(executor.map(send, range(num_requests)))
+
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, ok in outcomes if ok]
+
+    results = summarize(latencies, elapsed) if latencies else {"calls": 0}
+    results.update({
+        "target_rate": rate,
+        "duration_sec": duration,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+    })
+    return results
+
+
+if __name__ == "__main__":
+    tweets = generate_tweets(
+        args.bench_samples,
+        args.bench_min_words,
+        args.bench_max_words,
+        args.bench_contraction_rate,
+        args.bench_emoji_rate,
+        args.bench_url_rate,
+        seed=args.bench_seed,
+    )
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "settings": {name: value for name, value in vars(args).items() if value is None or isinstance(value, (int, float, str, bool))},
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for model_type in args.bench_model_types:
+            print(f"=== BENCHMARKING {model_type} ===")
+            classifier_path, mlm_path = build_tiny_models(directory, model_type, seed=args.bench_seed)
+            results = {}
+
+            if args.bench in ("micro", "all"):
+                results["micro"] = run_micro_benchmarks(tweets, classifier_path, mlm_path)
+
+            if args.bench in ("load", "all"):
+                port = free_port()
+                server = start_server(classifier_path, mlm_path, port)
+                try:
+                    results["load"] = run_load_test(
+                        tweets, f"http://127.0.0.1:{port}/process_tweet", args.bench_rate, args.bench_duration
+                    )
+                finally:
+                    server.terminate()
+                    server.wait()
+
+            report["results"][model_type] = results
+            print(json.dumps(results, indent=2))
+
+    with open(args.bench_output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+
+    print(f"Results written to {args.bench_output}")
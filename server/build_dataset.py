@@ -0,0 +1,108 @@
+import glob
+import os
+from timing import StartupTimer
+from arguments import args, apply_offline
+
+startup = StartupTimer()
+
+apply_offline(args)
+
+with startup.phase("imports"):
+    import pandas as pd
+    from tqdm import tqdm
+    from dataset import read_chunks, skip_rows
+    from preprocessor import Preprocessor
+    from workers import available_cores, preprocess_pool, disambiguate_async
+
+
+# Path of the index-th output shard.
+def shard_path(shard_dir, index):
+    return os.path.join(shard_dir, f"part-{index:05d}.csv")
+
+
+def build_dataset(preprocessor, input_path, shard_dir):
+    """
+    Preprocesses the text column of a raw CSV, JSONL or Parquet dump and writes it with
+    its label column as shards of args.shard_size rows, in the same headerless
+    "sentence,label" format as the training CSV.
+
+    The dump is read args.chunk_size rows at a time. clean_text's steps run over each
+    whole chunk as vectorized string operations, then contractions are disambiguated
+    by a pool of processes sharing the scoring model, each batching the MLM passes of
+    args.preprocess_batch_size texts together. A shard is only renamed to its final
+    name once complete, so rerunning the same command skips the rows in finished shards.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+
+    num_done = len(glob.glob(os.path.join(shard_dir, "part-*.csv")))
+    if num_done > 0:
+        print(f"Resuming after {num_done} finished shards")
+
+    pool = preprocess_pool(preprocessor, args.preprocess_workers or available_cores())
+
+    chunks = skip_rows(read_chunks(input_path, args.chunk_size), num_done * args.shard_size)
+    progress = tqdm(desc="Preprocessing", unit="rows", initial=num_done * args.shard_size)
+
+    shard = {"index": num_done, "rows": 0, "file": None}
+
+    # Appends rows to the current shard, finishing it and starting another whenever it is full.
+    def write_rows(rows):
+        while len(rows) > 0:
+            if shard["file"] is None:
+                shard["file"] = open(shard_path(shard_dir, shard["index"]) + ".tmp", "w")
+
+            part = rows.iloc[:args.shard_size - shard["rows"]]
+            part.to_csv(shard["file"], header=False, index=False)
+            shard["rows"] += len(part)
+            rows = rows.iloc[len(part):]
+
+            if shard["rows"] == args.shard_size:
+                finish_shard()
+
+    def finish_shard():
+        shard["file"].close()
+        path = shard_path(shard_dir, shard["index"])
+        os.replace(path + ".tmp", path)
+        shard.update(index=shard["index"] + 1, rows=0, file=None)
+
+    with pool:
+        # Clean and disambiguate the next chunk while the previous one is written.
+        pending = None
+        for chunk in chunks:
+            cleaned_texts = preprocessor.clean_texts(chunk[args.text_column].fillna("").astype(str))
+            preprocessed = disambiguate_async(pool, cleaned_texts.tolist(), args.preprocess_batch_size)
+
+            if pending is not None:
+                write_rows(finish_chunk(*pending))
+                progress.update(len(pending[0]))
+            pending = (chunk, preprocessed)
+
+        if pending is not None:
+            write_rows(finish_chunk(*pending))
+            progress.update(len(pending[0]))
+
+    if shard["file"] is not None:
+        finish_shard()
+
+    progress.close()
+    print(f"Wrote {shard['index']} shards to {shard_dir}")
+
+
+# Pairs a chunk's preprocessed sentences with its labels.
+def finish_chunk(chunk, preprocessed):
+    return pd.DataFrame({
+        "sentence": [text for batch in preprocessed.get() for text in batch],
+        "label": chunk[args.label_column].to_numpy(),
+    })
+
+
+if __name__ == "__main__":
+    if args.input_path is None:
+        raise ValueError("Pass the raw dump to preprocess with --input_path.")
+
+    with startup.phase("preprocessor"):
+        prep = Preprocessor.from_args(args)
+
+    startup.report()
+
+    build_dataset(prep, args.input_path, args.shard_dir)
@@ -0,0 +1,175 @@
+import atexit
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from queue import Queue, Empty
+
+# Most results the disk writer commits in one transaction.
+WRITE_BATCH_SIZE = 256
+# Seconds between deletions of expired rows from the disk store.
+PRUNE_INTERVAL = 600
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with a TTL for (expansion, decision) results, keyed on a hash
+    of the cleaned tweet text.
+
+    Entries live in memory first; if a path is given they are also written to a SQLite
+    file, which is consulted on memory misses so a restarted server starts warm. Disk
+    writes are queued to a background thread that commits them in batches, so requests
+    never wait on the disk, and expired rows are deleted when the file is opened and every
+    PRUNE_INTERVAL seconds. The namespace is mixed into every key so results from a
+    different model or preprocessing setup are never reused.
+    """
+
+    def __init__(self, max_size=10000, ttl=3600, path=None, namespace=""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.namespace = namespace
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self.db = None
+        if path is not None:
+            self.path = path
+            self.db = self._connect()
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            self._prune(self.db)
+            # Lookups use their own lock, so a slow disk read never blocks memory hits.
+            self.db_lock = threading.Lock()
+
+            self.writes = Queue()
+            self.writer = threading.Thread(target=self._write, name="result-cache-writer", daemon=True)
+            self.writer.start()
+            # Don't lose the last queued results when the process exits.
+            atexit.register(self.flush)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # Write-ahead logging lets lookups read while the writer commits.
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _prune(self, db):
+        if self.ttl > 0:
+            db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+        db.commit()
+
+    # Hashes a cleaned text into a cache key. Contraction expansion lowercases every
+    # word, so texts differing only in case share a result.
+    def key(self, cleaned_text):
+        return hashlib.sha256(
+            f"{self.namespace}\0{cleaned_text.lower()}".encode("utf-8")
+        ).hexdigest()
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    # Returns the cached value for a key, or None on a miss. Re-checks of a key
+    # that was already counted as a miss pass count_miss=False.
+    def get(self, key, count_miss=True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.expirations += 1
+
+        if self.db is not None:
+            with self.db_lock:
+                row = self.db.execute(
+                    "SELECT value, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and not self._expired(row[1]):
+                value = tuple(json.loads(row[0]))
+                with self.lock:
+                    self._insert(key, value, row[1])
+                    self.disk_hits += 1
+                return value
+
+        if count_miss:
+            with self.lock:
+                self.misses += 1
+        return None
+
+    # Stores a value, evicting the least recently used entries if full.
+    def put(self, key, value):
+        created = time.time()
+        with self.lock:
+            self._insert(key, value, created)
+
+        if self.db is not None:
+            self.writes.put((key, json.dumps(value), created))
+
+    # Blocks until every queued disk write is committed.
+    def flush(self):
+        if self.db is not None:
+            self.writes.join()
+
+    # Commits queued results in batches on the writer thread's own connection.
+    def _write(self):
+        db = self._connect()
+        last_prune = time.monotonic()
+
+        while True:
+            batch = [self.writes.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except Empty:
+                    break
+
+            try:
+                db.executemany("INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)", batch)
+                db.commit()
+
+                if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                    self._prune(db)
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                # The results are still in memory; losing their disk copy only costs a warm restart.
+                print(f"Could not write {len(batch)} results to {self.path}: {e!r}")
+            finally:
+                for _ in batch:
+                    self.writes.task_done()
+
+    def _insert(self, key, value, created):
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # Returns hit/miss/eviction counters.
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
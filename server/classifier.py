@@ -1,13 +1,54 @@
-from model import BertForSentimentClassification, AlbertForSentimentClassification, DistilBertForSentimentClassification
-
+from model import (
+    BertForSentimentClassification,
+    BertForEarlyExitSentimentClassification,
+    AlbertForSentimentClassification,
+    DistilBertForSentimentClassification,
+    model_fingerprint,
+)
+from metrics import timed, BATCH_SIZE, TOKENS, EXIT_LAYERS
+
+import hashlib
+import os
+import numpy as np
+import resource
+import time
+from contextlib import nullcontext
 from tqdm import tqdm
 import torch.nn as nn
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
 from transformers import (
     AutoTokenizer,
     AutoConfig
 )
 
+# File name of the exported model inside a model directory.
+ONNX_FILE_NAME = "model.onnx"
+
+def load_model(config, model_name_or_path, **kwargs):
+    if getattr(config, "early_exit", False):
+        # The config decides, so a plain BERT checkpoint can be loaded with new early-exit heads.
+        return BertForEarlyExitSentimentClassification.from_pretrained(model_name_or_path, config=config, **kwargs)
+    elif config.model_type == "bert":
+        return BertForSentimentClassification.from_pretrained(model_name_or_path, **kwargs)
+    elif config.model_type == "albert":
+        return AlbertForSentimentClassification.from_pretrained(model_name_or_path, **kwargs)
+    elif config.model_type == "distilbert":
+        return DistilBertForSentimentClassification.from_pretrained(model_name_or_path, **kwargs)
+    else:
+        raise ValueError("This transformer model is not supported yet.")
+
+def load_onnx_session(path):
+    # Imported here so onnxruntime is only needed when the ONNX backend is used.
+    import onnxruntime
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, export the model with export.py first.")
+
+    return onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
 def get_accuracy_from_logits(logits, labels):
     # Convert logits to probabilties
     probabilties = torch.sigmoid(logits.unsqueeze(-1))
@@ -16,59 +57,229 @@ def get_accuracy_from_logits(logits, labels):
     # Calculate qnd return accuracy
     return (predictions == labels).float().mean()
 
+def get_decision_from_probability(offensive_probability):
+    offensive_probability = offensive_probability * 100
+
+    is_offensive = offensive_probability > 0.5
+
+    if is_offensive:
+        return 1
+    else:
+        return 0
+
+class DistillationLoss(nn.Module):
+    """
+    Loss for training a student on a teacher's logits: (1 - alpha) times binary cross-entropy
+    against the hard labels, plus alpha times binary cross-entropy between the student's and
+    the teacher's probabilities, both softened by temperature. The soft term is scaled by
+    temperature squared so its gradients keep the same magnitude as temperature changes.
+    """
+
+    def __init__(self, alpha, temperature):
+        super().__init__()
+        self.alpha = alpha
+        self.temperature = temperature
+        self.bce = nn.BCEWithLogitsLoss()
+
+    def forward(self, input, target, teacher_logits):
+        hard_loss = self.bce(input, target)
+        soft_loss = self.bce(input / self.temperature, torch.sigmoid(teacher_logits / self.temperature))
+        return (1 - self.alpha) * hard_loss + self.alpha * self.temperature ** 2 * soft_loss
+
+class EarlyExitLoss(nn.Module):
+    """
+    Applies criterion to the logits of every exit of an early-exit model, of shape [B, L],
+    against the same targets, so all heads are trained jointly and weighted equally.
+    """
+
+    def __init__(self, criterion):
+        super().__init__()
+        self.criterion = criterion
+
+    def forward(self, input, *targets):
+        return self.criterion(input, *[target.unsqueeze(-1).expand_as(input) for target in targets])
+
+# Whether this process saves and reports, i.e. it isn't a non-zero rank of a distributed run.
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
 class Classifier:
     def __init__(self, for_training, args):
         # Default to BERT    
         if args.model_name_or_path is None:
-            if will_train:
+            if for_training:
                 args.model_name_or_path = "bert-base-uncased"
 
         print(f"Loading model {args.model_name_or_path}")
 
-        # Set up configuration.
-        self.config = AutoConfig.from_pretrained(args.model_name_or_path)
+        # Select how inference is run: "eager" fp32 PyTorch, "int8" dynamically quantized PyTorch, or "onnx" (ONNX Runtime).
+        self.backend = args.inference_backend
+        if for_training and self.backend != "eager":
+            raise ValueError("Only the eager backend can be trained.")
 
-        # Create the model with the given configuration.
-        if self.config.model_type == "bert":
-            self.model = BertForSentimentClassification.from_pretrained(
-                args.model_name_or_path
-            )
-        elif self.config.model_type == "albert":
-            self.model = AlbertForSentimentClassification.from_pretrained(
-                args.model_name_or_path
-            )
-        elif self.config.model_type == "distilbert":
-            self.model = DistilBertForSentimentClassification.from_pretrained(
-                args.model_name_or_path
-            )
+        # Set up configuration.
+        self.config = AutoConfig.from_pretrained(
+            args.model_name_or_path, local_files_only=args.offline
+        )
+
+        if for_training and args.early_exit:
+            if self.config.model_type != "bert":
+                raise ValueError("Early exit is only supported for BERT.")
+            self.config.early_exit = True
+
+        # Early-exit models have a head after every layer and stop once one is confident enough.
+        self.early_exit = getattr(self.config, "early_exit", False)
+        if self.early_exit and self.backend == "onnx":
+            raise ValueError("Early-exit models can only run on the eager and int8 backends.")
+        # Layers run and sequences classified by an early-exit model since the last evaluate.
+        self.layers_executed, self.num_exited = 0, 0
+
+        # Hash of the loaded weights, computed when first asked for.
+        self._fingerprint = None
+
+        if self.backend == "onnx":
+            # ONNX Runtime runs the exported graph on CPU; the PyTorch weights are never loaded.
+            self.device = torch.device("cpu")
+            self.model = None
+            self.onnx_path = os.path.join(args.model_name_or_path, ONNX_FILE_NAME)
+            self.session = load_onnx_session(self.onnx_path)
         else:
-            raise ValueError("This transformer model is not supported yet.")
+            # Create the model with the given configuration.
+            self.model = load_model(
+                self.config, args.model_name_or_path, local_files_only=args.offline
+            )
 
-        # Set up device as GPU if available, otherwise CPU.
-        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+            # Set up device as GPU if available, otherwise CPU.
+            self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+            if args.distributed and torch.cuda.is_available():
+                # Each local process gets its own GPU.
+                self.device = torch.device(f"cuda:{os.environ['LOCAL_RANK']}")
+
+            if self.backend == "int8":
+                # Quantized weights can't be hashed as plain tensors, so the fp32 weights identify the model.
+                self._fingerprint = model_fingerprint(self.model)
+                # Quantize the linear layers' weights to int8; activations are quantized on the fly. CPU only.
+                self.device = torch.device("cpu")
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {nn.Linear}, dtype=torch.qint8
+                )
+            elif self.backend != "eager":
+                raise ValueError(f"Unknown inference backend: {self.backend}")
 
-        # Put model to device.
-        self.model = self.model.to(self.device)
+            # Put model to device.
+            self.model = self.model.to(self.device)
 
-        # Set model to evaluation mode.
-        self.model.eval()
+            if self.early_exit:
+                self.model.exit_threshold = args.exit_threshold
+
+            # Set model to evaluation mode.
+            self.model.eval()
 
         # Initialize tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            args.model_name_or_path, local_files_only=args.offline
+        )
 
         # Set output directory.
         self.output_dir = args.output_dir
-    
+
+        # Training options: bfloat16 autocast, a compiled model, and batches per optimizer step.
+        self.bf16 = args.bf16
+        self.compile = args.compile
+        self.grad_accum_steps = args.grad_accum_steps
+        self.compiled_model = None
+
+        # In distributed training, gradients are averaged across ranks by a DDP wrapper, which
+        # also broadcasts rank 0's initial weights. self.model stays the plain module for evaluate and save.
+        self.ddp_model = None
+        if for_training and args.distributed:
+            self.freeze_unused_parameters()
+            self.ddp_model = DistributedDataParallel(self.model)
+
+    # Identifies the loaded weights, so results cached for one checkpoint are never reused for another,
+    # even when a retrained model is saved to the same directory.
+    def fingerprint(self):
+        if self._fingerprint is None:
+            if self.model is None:
+                digest = hashlib.sha1()
+                with open(self.onnx_path, "rb") as infile:
+                    for block in iter(lambda: infile.read(1 << 20), b""):
+                        digest.update(block)
+                self._fingerprint = digest.hexdigest()[:16]
+            else:
+                self._fingerprint = model_fingerprint(self.model)
+        return self._fingerprint
+
+    # Stops training parameters that don't affect the logits, like the unused pooler, which DDP would wait on forever.
+    def freeze_unused_parameters(self):
+        encoded = self.tokenizer(["probe"], return_tensors="pt").to(self.device)
+        # Probe in training mode, where early-exit models run every layer.
+        self.model.train()
+        self.model(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"]).sum().backward()
+        self.model.eval()
+
+        for parameter in self.model.parameters():
+            if parameter.grad is None:
+                parameter.requires_grad_(False)
+            parameter.grad = None
+
+    # Runs the model with the selected backend. Returns logits of shape [B, 1] and, for an early-exit
+    # model in evaluation, the number of layers each sequence ran, else None. The counts are returned
+    # rather than kept on the model, since batcher and executor threads share it.
+    def forward(self, input_ids, attention_mask):
+        if self.backend == "onnx":
+            (logits,) = self.session.run(
+                ["logits"],
+                {
+                    "input_ids": input_ids.cpu().numpy(),
+                    "attention_mask": attention_mask.cpu().numpy(),
+                },
+            )
+            return torch.from_numpy(logits), None
+
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+
+        if self.early_exit and not self.model.training:
+            return outputs
+        return outputs, None
+
+    # Exports the eager model to ONNX with dynamic batch and sequence dimensions.
+    def export_onnx(self, path):
+        if self.early_exit:
+            raise ValueError("Early-exit models can't be exported to ONNX, their layers depend on the data.")
+
+        input_ids = self.tokenizer(
+            ["export example"], return_tensors="pt"
+        )["input_ids"].to(self.device)
+        attention_mask = torch.ones_like(input_ids)
+
+        with torch.no_grad():
+            torch.onnx.export(
+                self.model,
+                (input_ids, attention_mask),
+                path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch"},
+                },
+                opset_version=17,
+            )
+
     # Evaluates analyzer.
     def evaluate(self, val_loader, criterion):
-        self.model.eval()
+        if self.model is not None:
+            self.model.eval()
 
         batch_accuracy_summation, loss, num_batches = 0, 0, 0
+        layers_executed, num_exited = 0, 0
 
         with torch.no_grad():
             # Go through validation set in batches.
             for input_ids, attention_mask, labels in tqdm(
-                val_loader, desc="Evaluating"
+                val_loader, desc="Evaluating", disable=not is_main_process()
             ):
                 # Put input IDs, attention mask, and labels to device.
                 input_ids, attention_mask, labels = (
@@ -77,75 +288,183 @@ class Classifier:
                     labels.to(self.device),
                 )
 
-                logits = self.model(input_ids=input_ids, attention_mask=attention_mask)
+                logits, exit_layers = self.forward(input_ids=input_ids, attention_mask=attention_mask)
+                if exit_layers is not None:
+                    layers_executed += int(exit_layers.sum())
+                    num_exited += len(exit_layers)
 
                 batch_accuracy_summation += get_accuracy_from_logits(logits, labels)
 
                 loss += criterion(logits.squeeze(-1), labels.float()).item()
 
                 num_batches += 1
+
+        if dist.is_initialized():
+            # Combine every rank's shard of the validation set.
+            totals = torch.tensor(
+                [float(batch_accuracy_summation), loss, num_batches, layers_executed, num_exited],
+                dtype=torch.float64,
+            )
+            dist.all_reduce(totals)
+            batch_accuracy_summation, loss, num_batches, layers_executed, num_exited = totals.tolist()
+
+        self.layers_executed, self.num_exited = layers_executed, num_exited
+
         # Calculate accuracy.
         accuracy = batch_accuracy_summation / num_batches
 
-        return accuracy.item(), loss
+        return float(accuracy), loss
 
-    # Trains analyzer for one epoch.
+    # Returns the logit of every row of dataset, in order, as one float32 array.
+    def predict_logits(self, dataset, batch_size, num_workers):
+        # Imported here so the server doesn't load pandas and scikit-learn with dataset.py at startup.
+        from dataset import collate_dynamic_padding
+
+        if self.model is not None:
+            self.model.eval()
+
+        # Sequential batches, each padded only to its longest sequence.
+        loader = DataLoader(
+            dataset, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_dynamic_padding
+        )
+
+        logits = []
+        with torch.no_grad():
+            for input_ids, attention_mask, *_ in tqdm(loader, desc="Predicting"):
+                batch_logits, _ = self.forward(
+                    input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device)
+                )
+                logits.append(batch_logits.squeeze(-1).float().cpu().numpy())
+
+        return np.concatenate(logits)
+
+    # Average number of encoder layers an early-exit model ran per sequence in the last evaluate.
+    def average_layers_executed(self):
+        return self.layers_executed / max(self.num_exited, 1)
+
+    # Trains analyzer for one epoch, returning its throughput, peak memory and what that peak covers.
     def train(self, train_loader, optimizer, criterion):
         self.model.train()
 
-        for input_ids, attention_mask, labels in tqdm(
-            iterable=train_loader, desc="Training"
-        ):
+        model = self.model if self.ddp_model is None else self.ddp_model
+        if self.compile:
+            # The compiled model shares its parameters with self.model, which evaluate and save keep using.
+            if self.compiled_model is None:
+                self.compiled_model = torch.compile(model)
+            model = self.compiled_model
+
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
 
-            optimizer.zero_grad()
+        num_batches = len(train_loader)
+        num_samples = 0
+        start = time.perf_counter()
+
+        optimizer.zero_grad()
+
+        # Batches may carry extra criterion inputs after the labels, like a teacher's soft labels.
+        for step, (input_ids, attention_mask, labels, *extra) in enumerate(tqdm(
+            iterable=train_loader, desc="Training", disable=not is_main_process()
+        )):
 
             input_ids, attention_mask, labels = (
                 input_ids.to(self.device),
                 attention_mask.to(self.device),
                 labels.to(self.device),
             )
+            extra = [tensor.to(self.device).float() for tensor in extra]
+
+            # Step after every grad_accum_steps batches, and after the last batch of the epoch.
+            should_step = (step + 1) % self.grad_accum_steps == 0 or step + 1 == num_batches
+
+            # Only average gradients across ranks on the batch before a step.
+            sync = nullcontext() if should_step or self.ddp_model is None else self.ddp_model.no_sync()
+
+            with sync:
+                with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                    logits = model(input_ids=input_ids, attention_mask=attention_mask)
 
-            logits = self.model(input_ids=input_ids, attention_mask=attention_mask)
+                # Early-exit models return one logit per layer, [B, L], even with one layer; the others [B, 1].
+                if not self.early_exit:
+                    logits = logits.squeeze(-1)
+                loss = criterion(logits.float(), labels.float(), *extra)
 
-            loss = criterion(input=logits.squeeze(-1), target=labels.float())
+                # Average the loss over the accumulated batches.
+                (loss / self.grad_accum_steps).backward()
 
-            loss.backward()
+            if should_step:
+                optimizer.step()
+                optimizer.zero_grad()
 
-            optimizer.step()
+            num_samples += len(labels)
 
-    # Saves analyzer.
+        if self.device.type == "cuda":
+            peak_memory = torch.cuda.max_memory_allocated(self.device)
+            peak_memory_label = "Peak CUDA memory this epoch"
+        else:
+            # ru_maxrss (in KiB on Linux) can't be reset, so on CPU this is the whole process's peak since it started.
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            peak_memory_label = "Peak process RSS so far"
+
+        elapsed = time.perf_counter() - start
+
+        if dist.is_initialized():
+            # Report the throughput of all ranks together and the largest peak of any rank.
+            totals = torch.tensor([num_samples], dtype=torch.float64)
+            peaks = torch.tensor([peak_memory], dtype=torch.float64)
+            dist.all_reduce(totals)
+            dist.all_reduce(peaks, op=dist.ReduceOp.MAX)
+            num_samples, peak_memory = totals.item(), peaks.item()
+
+        return {
+            "samples_per_sec": num_samples / elapsed,
+            "peak_memory_mb": peak_memory / 2**20,
+            "peak_memory_label": peak_memory_label,
+        }
+
+    # Saves analyzer, only from rank 0 in distributed training.
     def save(self):
+        if not is_main_process():
+            return
+
         self.model.save_pretrained(save_directory=f"models/{self.output_dir}/")
 
         self.config.save_pretrained(save_directory=f"models/{self.output_dir}/")
 
         self.tokenizer.save_pretrained(save_directory=f"models/{self.output_dir}/")
 
-    # Classifies sentiment as positve or negative.
-    def classify_sentiment(self, text):
+    # Computes the probability of being offensive for a batch of texts in one padded forward pass.
+    @timed("classify_sentiment")
+    def predict_probabilities(self, texts):
         # Don't track gradient.
         with torch.no_grad():
-            tokens = ["[CLS]"] + self.tokenizer.tokenize(text) + ["[SEP]"]
-            
-            input_ids = (
-                torch.tensor(self.tokenizer.convert_tokens_to_ids(tokens))
-                .unsqueeze(0)
-                .to(self.device)
+            encoded = self.tokenizer(
+                texts, padding=True, truncation=True, return_tensors="pt"
             )
 
-            attention_mask = (input_ids != 0).long()
+            BATCH_SIZE.observe(len(texts))
+            for length in encoded["attention_mask"].sum(dim=1).tolist():
+                TOKENS.observe(length)
 
-            logits = self.model(
+            input_ids = encoded["input_ids"].to(self.device)
+            attention_mask = encoded["attention_mask"].to(self.device)
+
+            logits, exit_layers = self.forward(
                 input_ids=input_ids, attention_mask=attention_mask
             )
-            
-            offensive_probability = torch.sigmoid(logits.unsqueeze(-1)).item()
-            
-            offensive_probability = offensive_probability * 100
-
-            is_offensive = offensive_probability > 0.5
-            
-            if is_offensive:
-                return 1
-            else:
-                return 0
\ No newline at end of file
+
+            if exit_layers is not None:
+                for layers in exit_layers.tolist():
+                    EXIT_LAYERS.observe(layers)
+
+            return torch.sigmoid(logits.squeeze(-1)).tolist()
+
+    # Classifies sentiment of a batch of texts, returning one decision per text.
+    def classify_sentiment_batch(self, texts):
+        probabilities = self.predict_probabilities(texts)
+
+        return [get_decision_from_probability(p) for p in probabilities]
+
+    # Classifies sentiment as positve or negative.
+    def classify_sentiment(self, text):
+        return self.classify_sentiment_batch([text])[0]
@@ -1,23 +1,140 @@
-from arguments import args
-from classifier import Classifier
-from preprocessor import Preprocessor
+import os
+import json
+from timing import StartupTimer
+from arguments import args, apply_offline
+
+startup = StartupTimer()
+
+apply_offline(args)
+
+with startup.phase("imports"):
+    import pandas as pd
+    from tqdm import tqdm
+    from classifier import Classifier, get_decision_from_probability
+    from dataset import atomic_write, read_chunks, skip_rows
+    from preprocessor import Preprocessor
+    from workers import available_cores, preprocess_pool, disambiguate_async
+
+def load_checkpoint(path, input_path):
+    if not os.path.exists(path):
+        return {"input_path": input_path, "rows": 0, "output_bytes": 0}
+
+    with open(path) as infile:
+        checkpoint = json.load(infile)
+
+    if checkpoint["input_path"] != input_path:
+        raise ValueError(f"{path} belongs to {checkpoint['input_path']}, not {input_path}.")
+
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    with atomic_write(path, "w") as outfile:
+        json.dump(checkpoint, outfile)
+
+
+def classify_file(preprocessor, classifier, input_path, output_path, checkpoint_path):
+    """
+    Classifies every row of input_path and writes id, probability and decision rows to
+    the output CSV.
+
+    The input is read args.chunk_size rows at a time, so memory stays constant however
+    large it is. Each chunk is cleaned with vectorized string operations and its
+    contractions are disambiguated by a pool of processes sharing the scoring model,
+    while the previous chunk is classified in batches of args.max_batch_size in this
+    process. After each chunk is written, the number of rows done and the output size are checkpointed;
+    rerunning the same command resumes from there.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, input_path)
+
+    # The output must still hold everything the checkpoint says was written to it.
+    output_bytes = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+    if output_bytes < checkpoint["output_bytes"]:
+        print(f"{output_path} is missing rows its checkpoint recorded, starting over")
+        checkpoint = {"input_path": input_path, "rows": 0, "output_bytes": 0}
+    elif checkpoint["rows"] > 0:
+        print(f"Resuming from row {checkpoint['rows']}")
+
+    # Drop anything written after the last checkpoint, or by an earlier run when starting fresh.
+    with open(output_path, "ab") as outfile:
+        outfile.truncate(checkpoint["output_bytes"])
+
+    pool = preprocess_pool(preprocessor, args.preprocess_workers or available_cores())
+
+    chunks = skip_rows(read_chunks(input_path, args.chunk_size), checkpoint["rows"])
+    progress = tqdm(desc="Classifying", unit="rows", initial=checkpoint["rows"])
+
+    with pool, open(output_path, "ab") as outfile:
+
+        # Classifies a preprocessed chunk, appends it to the output and checkpoints.
+        def write_chunk(chunk, preprocessed):
+            probabilities = []
+            texts = [text for batch in preprocessed.get() for text in batch]
+            for i in range(0, len(texts), args.max_batch_size):
+                probabilities.extend(classifier.predict_probabilities(texts[i:i + args.max_batch_size]))
+
+            if args.id_column is not None:
+                ids = chunk[args.id_column].to_numpy()
+            else:
+                ids = range(checkpoint["rows"], checkpoint["rows"] + len(chunk))
+
+            results = pd.DataFrame({
+                "id": ids,
+                "probability": probabilities,
+                "decision": [get_decision_from_probability(p) for p in probabilities],
+            })
+            results.to_csv(outfile, header=outfile.tell() == 0, index=False)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+            checkpoint["rows"] += len(chunk)
+            checkpoint["output_bytes"] = outfile.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+            progress.update(len(chunk))
+
+        # Preprocess the next chunk while the previous one is classified, holding at most two in memory.
+        pending = None
+        for chunk in chunks:
+            cleaned_texts = preprocessor.clean_texts(chunk[args.text_column].fillna("").astype(str))
+            preprocessed = disambiguate_async(pool, cleaned_texts.tolist(), args.preprocess_batch_size)
+
+            if pending is not None:
+                write_chunk(*pending)
+            pending = (chunk, preprocessed)
+
+        if pending is not None:
+            write_chunk(*pending)
+
+    progress.close()
+    print(f"Classified {checkpoint['rows']} rows into {output_path}")
+
 
 if __name__ == "__main__":
     # Initialize classifier.
-    classifier = Classifier(for_training=False, args=args)
-
-    prep = Preprocessor()
+    with startup.phase("classifier"):
+        classifier = Classifier(for_training=False, args=args)
 
-    preprocessed_text = prep.preprocess_sample(args.text)
+    with startup.phase("preprocessor"):
+        prep = Preprocessor.from_args(args)
 
-    print(f"Classifying: {preprocessed_text}")
+    startup.report()
 
-    result = classifier.classify_sentiment(preprocessed_text)
+    if args.input_path is not None:
+        classify_file(
+            prep,
+            classifier,
+            args.input_path,
+            args.output_path,
+            args.checkpoint_path or f"{args.output_path}.checkpoint",
+        )
+    else:
+        preprocessed_text = prep.preprocess_sample(args.text)
 
-    if (result == 0):
-        print(f"Model classified text as: 0: Normal")
-    elif (result == 1):
-        print(f"Model classified text as: 1: Offensive")
+        print(f"Classifying: {preprocessed_text}")
 
-        
+        result = classifier.classify_sentiment(preprocessed_text)
 
+        if (result == 0):
+            print(f"Model classified text as: 0: Normal")
+        elif (result == 1):
+            print(f"Model classified text as: 1: Offensive")
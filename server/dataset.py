@@ -1,43 +1,298 @@
+import hashlib
+import os
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
 import torch
-from torch.utils.data import Dataset
+from sklearn.model_selection import train_test_split
+from torch.utils.data import DataLoader, Dataset, DistributedSampler, Sampler
+from torch.utils.data.dataloader import default_collate
+
+DATA_PATH = "./data/final_preprocessed_data_yidong_devansh.csv"
+CACHE_DIR = "./data/cache"
+
+# Number of sentences given to the tokenizer at once when building the cache.
+ENCODE_BATCH_SIZE = 10000
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Identifies a tokenizer by its class, casing and vocabulary, so checkpoints sharing a vocabulary share cached encodings."""
+    digest = hashlib.sha1(
+        repr(
+            (
+                type(tokenizer).__name__,
+                tokenizer.init_kwargs.get("do_lower_case"),
+                sorted(tokenizer.get_vocab().items()),
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+    return f"{type(tokenizer).__name__}-{digest[:16]}"
+
+
+def dataframe_fingerprint(df):
+    """Hashes the sentences and labels of a data frame, in order."""
+    hashes = pd.util.hash_pandas_object(df[["sentence", "label"]], index=False)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()[:16]
+
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    Opens a temporary file next to path and renames it over path once the block finishes,
+    so readers, and reruns after a crash, never see a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as outfile:
+            yield outfile
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def save_array(path, array):
+    with atomic_write(path) as outfile:
+        np.save(outfile, array)
+
+
+def save_split(split, cache_dir=CACHE_DIR):
+    """
+    Writes a (train, validation) split to Parquet files under cache_dir, named by their
+    contents, and returns the path load_split reads it back from, e.g. in another process.
+    """
+    train_df, val_df = split
+    path = os.path.join(cache_dir, f"split-{dataframe_fingerprint(train_df)}-{dataframe_fingerprint(val_df)}")
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, df in [("train", train_df), ("val", val_df)]:
+        if not os.path.exists(f"{path}.{name}.parquet"):
+            with atomic_write(f"{path}.{name}.parquet") as outfile:
+                df.to_parquet(outfile, index=False)
+    return path
+
+
+def load_split(path=None):
+    """
+    Reads the training CSV and splits it into the same stratified 80% train and 20% validation frames every time.
+    With path, reads back the split save_split wrote there instead.
+    """
+    if path is not None:
+        return [pd.read_parquet(f"{path}.{name}.parquet") for name in ["train", "val"]]
+
+    full_df = pd.read_csv(DATA_PATH, names=["sentence", "label"])
+    return train_test_split(full_df, test_size=0.2, random_state=42, stratify=full_df["label"])
+
+
+# Yields data frames of at most chunk_size rows from a CSV, JSONL or Parquet file.
+def read_chunks(path, chunk_size):
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif path.endswith(".jsonl"):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_size)
+    elif path.endswith(".parquet"):
+        # Imported here so pyarrow is only needed for Parquet input.
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError("Input must be a .csv, .jsonl or .parquet file.")
+
+
+# Skips the first num_rows rows of a stream of chunks.
+def skip_rows(chunks, num_rows):
+    for chunk in chunks:
+        if num_rows >= len(chunk):
+            num_rows -= len(chunk)
+            continue
+        yield chunk.iloc[num_rows:]
+        num_rows = 0
+
 
 class ModyDataset(Dataset):
-    def __init__(self, maxlen, tokenizer, dataframe=None):
+    """
+    Tokenized sentences and labels, padded to maxlen.
+
+    The whole data frame is encoded once with the (fast) tokenizer in large batches and
+    written to .npy files under cache_dir, keyed by tokenizer, maxlen and data hash. Later
+    runs, and DataLoader workers, memory-map those files instead of keeping a pandas copy,
+    so rows are served as zero-copy tensor views over shared pages.
+
+    If soft_labels_path names a .npy file of one teacher logit per row, each item also
+    returns its soft label, for distillation.
+    """
+
+    def __init__(self, maxlen, tokenizer, dataframe=None, cache_dir=CACHE_DIR, soft_labels_path=None):
         if dataframe is not None:
-            self.df = dataframe.reset_index(drop=True)
+            df = dataframe.reset_index(drop=True)
         else:
-            self.df = pd.read_csv(
-                "./data/final_preprocessed_data_yidong_devansh.csv", 
-                names=["sentence", "label"]
-            )
-        
-        self.tokenizer = tokenizer
+            df = pd.read_csv(DATA_PATH, names=["sentence", "label"])
+
         self.maxlen = maxlen
+        self.soft_labels_path = soft_labels_path
+        self.cache_prefix = os.path.join(
+            cache_dir,
+            f"{tokenizer_fingerprint(tokenizer)}-{maxlen}-{dataframe_fingerprint(df)}",
+        )
 
-    def __len__(self):
-        return len(self.df)
+        if not os.path.exists(self.cache_path("labels")):
+            os.makedirs(cache_dir, exist_ok=True)
+            self.encode(df, tokenizer)
 
-    def __getitem__(self, index):
-        # Select sentence and label at specified index from data frame.
-        sentence = self.df.loc[index, "sentence"]
-        label = self.df.loc[index, "label"]
+        self.load()
 
-        # Preprocess text to be suitable for transformer
-        tokens = self.tokenizer.tokenize(sentence)
-        tokens = ["[CLS]"] + tokens + ["[SEP]"]
+    def cache_path(self, name):
+        return f"{self.cache_prefix}.{name}.npy"
 
-        if len(tokens) < self.maxlen:
-            tokens = tokens + ["[PAD]" for _ in range(self.maxlen - len(tokens))]
-        else:
-            tokens = tokens[: self.maxlen - 1] + ["[SEP]"]
+    # Tokenizes every sentence once and writes input IDs, lengths and labels to the cache.
+    def encode(self, df, tokenizer):
+        input_ids = np.empty((len(df), self.maxlen), dtype=np.int64)
+        lengths = np.empty(len(df), dtype=np.int64)
 
-        # Obtain indices of tokens and convert them to tensor.
-        input_ids = torch.tensor(self.tokenizer.convert_tokens_to_ids(tokens))
+        sentences = df["sentence"].tolist()
+        for start in range(0, len(sentences), ENCODE_BATCH_SIZE):
+            encoded = tokenizer(
+                sentences[start:start + ENCODE_BATCH_SIZE],
+                truncation=True,
+                max_length=self.maxlen,
+                padding="max_length",
+                return_attention_mask=True,
+                return_tensors="np",
+            )
+            input_ids[start:start + len(encoded["input_ids"])] = encoded["input_ids"]
+            lengths[start:start + len(encoded["input_ids"])] = encoded["attention_mask"].sum(axis=1)
+
+        save_array(self.cache_path("input_ids"), input_ids)
+        save_array(self.cache_path("lengths"), lengths)
+        # Labels are written last; their presence marks a complete cache entry.
+        save_array(self.cache_path("labels"), df["label"].to_numpy(dtype=np.float32))
+
+    # Memory-maps the cached arrays copy-on-write, so tensors can view them without copying.
+    def load(self):
+        self.input_ids = np.load(self.cache_path("input_ids"), mmap_mode="c")
+        self.lengths = np.load(self.cache_path("lengths"), mmap_mode="c")
+        self.labels = np.load(self.cache_path("labels"), mmap_mode="c")
+        self.soft_labels = None
+        if self.soft_labels_path is not None:
+            self.soft_labels = np.load(self.soft_labels_path, mmap_mode="c")
+
+    # Only the cache location is pickled; spawned workers re-map the files themselves.
+    def __getstate__(self):
+        return {"maxlen": self.maxlen, "cache_prefix": self.cache_prefix, "soft_labels_path": self.soft_labels_path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        # View the cached token indices as a tensor.
+        input_ids = torch.from_numpy(self.input_ids[index])
         # Obtain attention mask i.e. a tensor containing 1s for no padded tokens and 0s for padded ones.
         attention_mask = (input_ids != 0).long()
 
-        label = torch.tensor(float(label))
+        label = torch.tensor(self.labels[index])
+
+        if self.soft_labels is not None:
+            return input_ids, attention_mask, label, torch.tensor(self.soft_labels[index])
 
         # Return input IDs, attention mask, and label.
-        return input_ids, attention_mask, label
\ No newline at end of file
+        return input_ids, attention_mask, label
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Yields batches of indices whose examples have similar lengths.
+
+    Indices are (optionally shuffled and) cut into buckets of bucket_size batches;
+    each bucket is sorted by length and split into batches, and with shuffle the
+    batch order is shuffled too. Each pass over the sampler uses a new, seeded shuffle.
+
+    With num_replicas > 1, every rank builds the same batches and takes every
+    num_replicas-th one starting at its rank, wrapping around so all ranks get the
+    same number of batches.
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=False, bucket_size=100, seed=0, num_replicas=1, rank=0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+
+        indices = np.arange(len(self.lengths))
+        if self.shuffle:
+            indices = rng.permutation(indices)
+
+        batches = []
+        step = self.batch_size * self.bucket_size
+        for start in range(0, len(indices), step):
+            bucket = indices[start:start + step]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            batches.extend(
+                bucket[i:i + self.batch_size].tolist()
+                for i in range(0, len(bucket), self.batch_size)
+            )
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        if self.num_replicas > 1:
+            padding = len(self) * self.num_replicas - len(batches)
+            batches = (batches + batches[:padding])[self.rank::self.num_replicas]
+
+        return iter(batches)
+
+    def __len__(self):
+        num_batches = (len(self.lengths) + self.batch_size - 1) // self.batch_size
+        return (num_batches + self.num_replicas - 1) // self.num_replicas
+
+
+def collate_dynamic_padding(batch):
+    """Stacks a batch and trims padding down to its longest sequence."""
+    input_ids, attention_mask, *rest = default_collate(batch)
+    longest = int(attention_mask.sum(dim=1).max())
+    return (input_ids[:, :longest], attention_mask[:, :longest], *rest)
+
+
+def make_loader(dataset, batch_size, num_workers, bucket_by_length=False, shuffle=False, distributed=False):
+    """
+    Builds a DataLoader, optionally with length-bucketed batches padded only to their longest sequence.
+    With distributed, each rank of the initialized process group loads its own shard of the dataset.
+    With shuffle, every path draws a new order each epoch.
+    """
+    num_replicas, rank = 1, 0
+    if distributed:
+        num_replicas, rank = torch.distributed.get_world_size(), torch.distributed.get_rank()
+
+    if not bucket_by_length:
+        if distributed:
+            return DataLoader(
+                dataset=dataset,
+                batch_size=batch_size,
+                sampler=DistributedSampler(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle),
+                num_workers=num_workers,
+            )
+
+        return DataLoader(
+            dataset=dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers
+        )
+
+    return DataLoader(
+        dataset=dataset,
+        batch_sampler=BucketBatchSampler(
+            dataset.lengths, batch_size, shuffle=shuffle, num_replicas=num_replicas, rank=rank
+        ),
+        collate_fn=collate_dynamic_padding,
+        num_workers=num_workers,
+    )
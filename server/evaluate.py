@@ -1,31 +1,198 @@
+import argparse
+import glob
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
 import torch.nn as nn
-from torch.utils.data import DataLoader
 
-from dataset import ModyDataset
+from dataset import ModyDataset, atomic_write, load_split, make_loader, tokenizer_fingerprint
 from arguments import args
 from classifier import Classifier
 
 
+# Where a model's validation logits are stored, named after the model.
+def logits_path(model_name_or_path):
+    name = re.sub(r"[^\w.-]+", "_", model_name_or_path.strip("/"))
+    return os.path.join(args.logits_dir, f"{name}.npz")
+
+
+def run_models(model_names_or_paths, val_df):
+    """
+    Runs every model over the validation split and stores its logits, the labels and its
+    throughput in --logits_dir. The split is tokenized once per distinct tokenizer and the
+    encoded dataset is shared by all models using that tokenizer.
+    """
+    os.makedirs(args.logits_dir, exist_ok=True)
+    datasets = {}
+
+    for model_name_or_path in model_names_or_paths:
+        classifier = Classifier(
+            for_training=False, args=argparse.Namespace(**{**vars(args), "model_name_or_path": model_name_or_path})
+        )
+
+        fingerprint = tokenizer_fingerprint(classifier.tokenizer)
+        if fingerprint not in datasets:
+            datasets[fingerprint] = ModyDataset(maxlen=args.maxlen_val, tokenizer=classifier.tokenizer, dataframe=val_df)
+        val_set = datasets[fingerprint]
+
+        start = time.perf_counter()
+        logits = classifier.predict_logits(val_set, args.batch_size, args.num_threads)
+        elapsed = time.perf_counter() - start
+
+        with atomic_write(logits_path(model_name_or_path)) as outfile:
+            np.savez(outfile, logits=logits, labels=np.asarray(val_set.labels), samples_per_sec=len(val_set) / elapsed)
+
+
+# Divides element-wise, giving 0 wherever the denominator is 0.
+def safe_divide(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=np.asarray(denominator) > 0)
+
+
+def sweep_thresholds(probabilities, labels, thresholds):
+    """
+    Computes the exact confusion matrix at every threshold at once, predicting offensive
+    where the probability is above the threshold. Returns a data frame with one row per threshold.
+    """
+    positives = np.sort(probabilities[labels == 1])
+    negatives = np.sort(probabilities[labels == 0])
+
+    tp = len(positives) - np.searchsorted(positives, thresholds, side="right")
+    fp = len(negatives) - np.searchsorted(negatives, thresholds, side="right")
+    fn = len(positives) - tp
+    tn = len(negatives) - fp
+
+    precision = safe_divide(tp, tp + fp)
+    recall = safe_divide(tp, tp + fn)
+
+    return pd.DataFrame({
+        "threshold": thresholds,
+        "tp": tp,
+        "fp": fp,
+        "tn": tn,
+        "fn": fn,
+        "accuracy": (tp + tn) / len(labels),
+        "precision": precision,
+        "recall": recall,
+        "f1": safe_divide(2 * precision * recall, precision + recall),
+    })
+
+
+def roc_pr_curves(probabilities, labels):
+    """
+    Computes the exact ROC and precision-recall curves, with a point at every distinct
+    probability, and the areas under them. Returns a data frame of the curves' points,
+    the ROC AUC and the average precision, which are NaN when there are no rows.
+    """
+    if len(probabilities) == 0:
+        empty = pd.DataFrame(columns=["threshold", "fpr", "tpr", "precision", "recall"], dtype=float)
+        return empty, float("nan"), float("nan")
+
+    order = np.argsort(-probabilities, kind="mergesort")
+    scores, sorted_labels = probabilities[order], labels[order]
+
+    # Last position of every distinct probability, so tied rows enter the curves together.
+    distinct = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tp = np.cumsum(sorted_labels)[distinct]
+    fp = distinct + 1 - tp
+
+    tpr = safe_divide(tp, tp[-1])
+    fpr = safe_divide(fp, fp[-1])
+    precision = tp / (tp + fp)
+
+    # Trapezoidal area, written out since np.trapz is gone in NumPy 2 and np.trapezoid is new in it.
+    roc_fpr, roc_tpr = np.r_[0, fpr], np.r_[0, tpr]
+    roc_auc = np.sum(np.diff(roc_fpr) * (roc_tpr[1:] + roc_tpr[:-1]) / 2)
+    average_precision = np.sum(np.diff(np.r_[0, tpr]) * precision)
+
+    curves = pd.DataFrame({
+        "threshold": scores[distinct],
+        "fpr": fpr,
+        "tpr": tpr,
+        "precision": precision,
+        "recall": tpr,
+    })
+    return curves, roc_auc, average_precision
+
+
+def compare_models(model_names):
+    """
+    Computes and prints metrics for every model from its stored logits, and writes the
+    threshold sweep and the curves of all models to thresholds.csv and curves.csv in --logits_dir.
+    """
+    thresholds = np.linspace(0, 1, args.num_thresholds + 2)[1:-1]
+    sweeps, all_curves = [], []
+
+    for name in model_names:
+        stored = np.load(logits_path(name))
+        labels = stored["labels"].astype(np.int64)
+        probabilities = 1 / (1 + np.exp(-stored["logits"].astype(np.float64)))
+
+        sweep = sweep_thresholds(probabilities, labels, np.r_[0.5, thresholds])
+        curves, roc_auc, average_precision = roc_pr_curves(probabilities, labels)
+
+        at_half, sweep = sweep.iloc[0], sweep.iloc[1:]
+        best = sweep.loc[sweep["accuracy"].idxmax()]
+
+        print(f"{name} : {float(stored['samples_per_sec']):.1f} samples/sec")
+        print(
+            f"    Accuracy : {at_half['accuracy']:.4f} at 0.5, {best['accuracy']:.4f} at best threshold {best['threshold']:.3f}, "
+            f"ROC AUC : {roc_auc:.4f}, Average Precision : {average_precision:.4f}"
+        )
+        print(
+            f"    Confusion matrix at 0.5 : TP {at_half['tp']:.0f}, FP {at_half['fp']:.0f}, TN {at_half['tn']:.0f}, FN {at_half['fn']:.0f}"
+        )
+
+        sweeps.append(sweep.assign(model=name))
+        all_curves.append(curves.assign(model=name))
+
+    pd.concat(sweeps).to_csv(os.path.join(args.logits_dir, "thresholds.csv"), index=False)
+    pd.concat(all_curves).to_csv(os.path.join(args.logits_dir, "curves.csv"), index=False)
+    print(f"Wrote thresholds.csv and curves.csv to {args.logits_dir}")
+
+
 if __name__ == "__main__":
 
-    # Initialize analyzer.
-    classifier = Classifier(for_training=False, args=args)
+    if args.model_names_or_paths is not None or args.from_logits:
+        # Compare models on the validation split held out by train.py.
+        if args.from_logits:
+            model_names = args.model_names_or_paths or sorted(
+                os.path.splitext(os.path.basename(path))[0]
+                for path in glob.glob(os.path.join(args.logits_dir, "*.npz"))
+            )
+        else:
+            model_names = args.model_names_or_paths
+            _, val_df = load_split()
+            run_models(model_names, val_df)
+
+        compare_models(model_names)
+
+    else:
+        # Initialize analyzer.
+        classifier = Classifier(for_training=False, args=args)
 
-    # Set citerion, which takes as input logits of positive class and computes binary cross-entropy.
-    criterion = nn.BCEWithLogitsLoss()
+        # Set citerion, which takes as input logits of positive class and computes binary cross-entropy.
+        criterion = nn.BCEWithLogitsLoss()
 
-    # Initialize validation set and loader.
-    val_set = ModyDataset(
-        maxlen=args.maxlen_val, tokenizer=classifier.tokenizer
-    )
-    val_loader = DataLoader(
-        dataset=val_set, batch_size=args.batch_size, num_workers=args.num_threads
-    )
+        # Initialize validation set and loader.
+        val_set = ModyDataset(
+            maxlen=args.maxlen_val, tokenizer=classifier.tokenizer
+        )
+        val_loader = make_loader(
+            val_set, args.batch_size, args.num_threads,
+            bucket_by_length=args.bucket_by_length,
+        )
 
-    # Evaluate analyzer and get accuracy + loss.
-    val_accuracy, val_loss = classifier.evaluate(
-        val_loader=val_loader, criterion=criterion
-    )
+        # Evaluate analyzer and get accuracy + loss.
+        val_accuracy, val_loss = classifier.evaluate(
+            val_loader=val_loader, criterion=criterion
+        )
 
-    # Display accuracy and loss.
-    print(f"Validation Accuracy : {val_accuracy}, Validation Loss : {val_loss}")
\ No newline at end of file
+        # Display accuracy and loss.
+        print(f"Validation Accuracy : {val_accuracy}, Validation Loss : {val_loss}")
+        if classifier.early_exit:
+            print(
+                f"Average layers executed : {classifier.average_layers_executed():.2f} of {classifier.config.num_hidden_layers} at exit threshold {args.exit_threshold}"
+            )
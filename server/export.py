@@ -0,0 +1,61 @@
+import os
+import time
+
+import pandas as pd
+import torch.nn as nn
+
+from dataset import DATA_PATH, ModyDataset, make_loader
+from arguments import args
+from classifier import Classifier, ONNX_FILE_NAME
+
+
+if __name__ == "__main__":
+    # The ONNX backend loads model.onnx from the model directory, so there must be one to write it to.
+    if args.model_name_or_path is None or not os.path.isdir(args.model_name_or_path):
+        raise ValueError(
+            f"--model_name_or_path must be a local model directory to export into, not {args.model_name_or_path!r}. "
+            "Save a Hugging Face Hub model locally first, e.g. by training it with train.py."
+        )
+
+    # Export from the full-precision PyTorch model.
+    args.inference_backend = "eager"
+    classifier = Classifier(for_training=False, args=args)
+
+    onnx_path = os.path.join(args.model_name_or_path, ONNX_FILE_NAME)
+    print(f"Exporting {args.model_name_or_path} to {onnx_path}")
+    classifier.export_onnx(onnx_path)
+
+    # Check every backend reaches the same accuracy as evaluate.py on the same rows.
+    criterion = nn.BCEWithLogitsLoss()
+
+    df = pd.read_csv(DATA_PATH, names=["sentence", "label"])
+    if args.parity_samples > 0:
+        df = df.head(args.parity_samples)
+
+    results = {}
+    for backend in ["eager", "int8", "onnx"]:
+        args.inference_backend = backend
+        classifier = Classifier(for_training=False, args=args)
+
+        val_set = ModyDataset(
+            maxlen=args.maxlen_val, tokenizer=classifier.tokenizer, dataframe=df
+        )
+        val_loader = make_loader(
+            val_set, args.batch_size, args.num_threads,
+            bucket_by_length=args.bucket_by_length,
+        )
+
+        start = time.perf_counter()
+        val_accuracy, val_loss = classifier.evaluate(
+            val_loader=val_loader, criterion=criterion
+        )
+        elapsed = time.perf_counter() - start
+
+        results[backend] = val_accuracy
+        print(
+            f"{backend}: Validation Accuracy : {val_accuracy}, Validation Loss : {val_loss}, "
+            f"{len(val_set) / elapsed:.1f} samples/sec"
+        )
+
+    for backend in ["int8", "onnx"]:
+        print(f"{backend} accuracy difference from eager: {results[backend] - results['eager']:+.4f}")
@@ -1,13 +1,167 @@
 import random # Import the random module
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from arguments import args
-from classifier import Classifier
-from preprocessor import Preprocessor
+import json
+import logging
+import time
+from timing import StartupTimer
+from arguments import args, apply_offline
 
-preprocessor = Preprocessor()
+startup = StartupTimer()
 
-classifier = Classifier(for_training=False, args=args)
+apply_offline(args)
+
+with startup.phase("imports"):
+    from flask import Flask, Response, request, jsonify, stream_with_context, g
+    from flask_cors import CORS
+    from classifier import Classifier
+    from preprocessor import Preprocessor
+    from batcher import MicroBatcher, Overloaded, DeadlineExceeded
+    from serving import ModelExecutor, RequestLogger, run_production
+    from workers import InferenceWorkerPool
+    from metrics import REGISTRY, REQUEST_SECONDS, Counter, Gauge
+    from profiler import sample_stacks
+    from cache import ResultCache
+    from singleflight import SingleFlight
+
+with startup.phase("preprocessor"):
+    preprocessor = Preprocessor.from_args(args)
+
+with startup.phase("classifier"):
+    classifier = Classifier(for_training=False, args=args)
+
+# Fork the worker processes before any other thread starts, so they share the loaded weights.
+worker_pool = None
+if args.inference_workers > 0:
+    with startup.phase("inference workers"):
+        worker_pool = InferenceWorkerPool(
+            preprocessor,
+            classifier,
+            num_workers=args.inference_workers,
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_batch_wait_ms,
+            max_queue_size=args.max_queue_size,
+        )
+
+# Group concurrent requests into a single forward pass.
+batcher = MicroBatcher(
+    classifier,
+    max_batch_size=args.max_batch_size,
+    max_wait_ms=args.max_batch_wait_ms,
+    max_queue_size=args.max_queue_size,
+)
+
+# Run contraction disambiguation off the request threads, behind a bounded queue.
+model_executor = ModelExecutor(
+    max_workers=args.model_threads, max_queue_size=args.max_queue_size
+)
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+request_logger = RequestLogger(sample_rate=args.log_sample_rate)
+
+# Remember (expansion, decision) results for texts we have already seen, keyed on the
+# classifier's weights and every setting that changes a text's expansion or decision.
+with startup.phase("result cache"):
+    result_cache = ResultCache(
+        max_size=args.cache_size,
+        ttl=args.cache_ttl,
+        path=args.cache_path,
+        namespace="|".join(str(setting) for setting in [
+            classifier.fingerprint(),
+            args.inference_backend,
+            args.exit_threshold,
+            args.scoring_model_name_or_path,
+            args.contraction_scoring,
+            args.contraction_beam_width,
+            args.contraction_context_window,
+        ]),
+    )
+
+# Share one preprocessing and classification job between identical texts in flight.
+in_flight = SingleFlight()
+
+# Expose queue depths, cache counters and coalesced requests, read whenever /metrics is scraped.
+REGISTRY.register(Gauge(
+    "queue_depth",
+    "Texts waiting for the models.",
+    lambda: {
+        "batcher": batcher.queue_depth(),
+        "workers": worker_pool.queue_depth() if worker_pool is not None else 0,
+    },
+    label="queue",
+))
+REGISTRY.register(Gauge(
+    "result_cache",
+    "Result cache counters.",
+    result_cache.stats,
+    label="stat",
+))
+REGISTRY.register(Counter(
+    "coalesced_requests_total", "Requests that shared another in-flight request's result.", lambda: in_flight.coalesced
+))
+
+# Returns the time.monotonic() deadline for a request starting now, or None if requests never expire.
+def request_deadline():
+    if args.request_timeout_ms <= 0:
+        return None
+    return time.monotonic() + args.request_timeout_ms / 1000
+
+# Preprocesses and classifies a text, going through the result cache.
+def classify_text(text, deadline=None):
+    cleaned_text = preprocessor.clean_text(text)
+    key = result_cache.key(cleaned_text)
+
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    def compute():
+        # A job for this text may have finished between the cache lookup and now.
+        cached = result_cache.get(key, count_miss=False)
+        if cached is not None:
+            return cached
+
+        if worker_pool is not None:
+            result = worker_pool.run(cleaned_text, deadline=deadline)
+        else:
+            preprocessed_text = model_executor.run(
+                preprocessor.disambiguate, cleaned_text, deadline=deadline
+            )
+            result = (preprocessed_text, batcher.classify(preprocessed_text, deadline=deadline))
+
+        result_cache.put(key, result)
+        return result
+
+    return in_flight.do(key, compute, deadline=deadline)
+
+# Preprocesses and classifies a chunk of texts, classifying all cache misses in one forward pass.
+def classify_texts(texts):
+    cleaned_texts = [preprocessor.clean_text(text) for text in texts]
+    keys = [result_cache.key(cleaned_text) for cleaned_text in cleaned_texts]
+
+    results = [result_cache.get(key) for key in keys]
+
+    # Classify each distinct missing text only once.
+    misses = {}
+    for i, result in enumerate(results):
+        if result is None:
+            misses.setdefault(keys[i], i)
+
+    if misses:
+        if worker_pool is not None:
+            computed = dict(zip(misses, worker_pool.run_many([cleaned_texts[i] for i in misses.values()])))
+        else:
+            preprocessed_texts = preprocessor.disambiguate_batch([cleaned_texts[i] for i in misses.values()])
+            decisions = classifier.classify_sentiment_batch(preprocessed_texts)
+            computed = dict(zip(misses, zip(preprocessed_texts, decisions)))
+
+        for key, result in computed.items():
+            result_cache.put(key, result)
+
+        results = [
+            result if result is not None else computed[key]
+            for key, result in zip(keys, results)
+        ]
+
+    return results
 
 # 1. Create an instance of the Flask class
 app = Flask(__name__)
@@ -15,6 +169,36 @@ app = Flask(__name__)
 # 2. Enable CORS
 CORS(app)
 
+# Refuse work when the model queues are full, and give up on requests past their deadline.
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    return jsonify({"error": "Server is overloaded, retry later"}), 503, {"Retry-After": "1"}
+
+@app.errorhandler(DeadlineExceeded)
+def handle_deadline_exceeded(error):
+    return jsonify({"error": "Request deadline exceeded"}), 504
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+# Log a sample of requests as structured JSON lines instead of printing payloads.
+@app.after_request
+def log_request(response):
+    latency = time.perf_counter() - g.start
+
+    # Label by route rather than raw path, so unknown URLs can't grow the metric without bound.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUEST_SECONDS.observe(latency, path=route, status=response.status_code)
+    request_logger.log(
+        request.method,
+        request.path,
+        response.status_code,
+        latency,
+        content_length=request.content_length,
+    )
+    return response
+
 # 3. Define a route that accepts POST requests
 @app.route('/process_tweet', methods=['POST'])
 def process_tweet():
@@ -22,27 +206,21 @@ def process_tweet():
     Receives tweet text via POST request, classifies the text,
     and returns the decision along with the original text.
     """
-    print("Received request on /process_tweet")
-
     if not request.is_json:
-        print("Error: Request is not JSON")
         return jsonify({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
-    print(f"Received data: {data}")
 
     if 'tweet_text' not in data:
-        print("Error: 'tweet_text' key missing")
         return jsonify({"error": "'tweet_text' key missing in JSON data"}), 400
 
     original_text = data['tweet_text']
 
-    preprocessed_text = preprocessor.preprocess_sample(original_text)
+    if not isinstance(original_text, str):
+        return jsonify({"error": "'tweet_text' must be a string"}), 400
 
-    # Generate a random decision (0 or 1)
-    result = classifier.classify_sentiment(preprocessed_text)
-    
-    print(f"Generated decision: {result} for text: {original_text[:50]}...")
+    # Generate a decision (0 or 1)
+    _, result = classify_text(original_text, deadline=request_deadline())
 
     # Return the decision and original text in a JSON response
     return jsonify({
@@ -50,11 +228,96 @@ def process_tweet():
         "decision": result    # Send the decision
     })
 
+# Accepts many tweets at once and streams back one JSON line per tweet
+@app.route('/process_tweets', methods=['POST'])
+def process_tweets():
+    """
+    Receives a JSON array of {"id": ..., "tweet_text": ...} objects, classifies
+    them in chunks of --max_batch_size and streams newline-delimited JSON
+    results back as soon as each chunk is done.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    tweets = request.get_json()
+
+    if not isinstance(tweets, list):
+        return jsonify({"error": "Expected a JSON array of tweets"}), 400
+
+    for tweet in tweets:
+        if not isinstance(tweet, dict) or 'tweet_text' not in tweet:
+            return jsonify({"error": "'tweet_text' key missing in JSON data"}), 400
+        if not isinstance(tweet['tweet_text'], str):
+            return jsonify({"error": "'tweet_text' must be a string"}), 400
+
+    def generate():
+        for start in range(0, len(tweets), args.max_batch_size):
+            chunk = tweets[start:start + args.max_batch_size]
+
+            # The response has already started, so a failed chunk is reported per tweet.
+            try:
+                results = model_executor.run(
+                    classify_texts, [tweet['tweet_text'] for tweet in chunk]
+                )
+            except Overloaded:
+                error = "overloaded"
+            except DeadlineExceeded:
+                error = "deadline exceeded"
+            except Exception:
+                app.logger.exception("Classifying a chunk of /process_tweets failed")
+                error = "internal error"
+            else:
+                error = None
+
+            if error is not None:
+                yield "".join(
+                    json.dumps({"id": tweet.get('id'), "error": error}) + "\n"
+                    for tweet in chunk
+                )
+                continue
+
+            yield "".join(
+                json.dumps({"id": tweet.get('id'), "decision": result}) + "\n"
+                for tweet, (_, result) in zip(chunk, results)
+            )
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# Report result cache counters
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+# Expose latency, batch, queue and cache metrics in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# Sample the server's Python stacks for a few seconds and return them as collapsed stacks
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    if not args.enable_profiler:
+        return jsonify({"error": "Start the server with --enable_profiler to profile it"}), 404
+
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        return jsonify({"error": "'seconds' must be a number"}), 400
+    if not 0 < seconds <= 60:
+        return jsonify({"error": "'seconds' must be between 0 and 60"}), 400
+
+    return Response(sample_stacks(seconds), mimetype="text/plain")
+
 # Keep the root route for basic testing
 @app.route('/', methods=['GET'])
 def hello_world():
     return "Flask API for tweet random decision is running!"
 
+startup.report()
+
 # 4. Run the application server
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if args.serve_mode == "production":
+        run_production(app, host=args.host, port=args.port, threads=args.server_threads)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
@@ -0,0 +1,175 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+# Escapes a label value as the text exposition format requires.
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """Base class for a named metric whose values are keyed by their sorted labels."""
+
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    # Returns the values recorded since the last drain and resets them.
+    def drain(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    # Values are stored as [count per bucket..., count above the last bucket, sum].
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            index = next(
+                (i for i, bound in enumerate(self.buckets) if value <= bound),
+                len(self.buckets),
+            )
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, values):
+        with self.lock:
+            for key, counts in values.items():
+                current = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+                for i, count in enumerate(counts):
+                    current[i] += count
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, counts in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                cumulative += counts[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {counts[-1]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge(Metric):
+    """A value read at scrape time from a callback returning a number or a {label value: number} dict."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, read, label=None):
+        super().__init__(name, help)
+        self.read = read
+        self.label = label
+
+    def drain(self):
+        return {}
+
+    def render(self):
+        value = self.read()
+        if self.label is None:
+            return self.header() + [f"{self.name} {value}"]
+        return self.header() + [
+            f"{self.name}{format_labels(((self.label, key),))} {item}" for key, item in value.items()
+        ]
+
+
+class Counter(Gauge):
+    """A running total read at scrape time, exposed as a counter so rate() can be taken over it."""
+
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    # Renders every metric in the Prometheus text exposition format.
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # Collects and resets the values recorded in this process, e.g. to ship them from a worker.
+    def drain(self):
+        return {name: metric.drain() for name, metric in self.metrics.items()}
+
+    # Adds values drained from another process.
+    def merge(self, drained):
+        for name, values in drained.items():
+            if values:
+                self.metrics[name].merge(values)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "tweet_stage_seconds", "Time spent in each preprocessing and classification stage."
+))
+CANDIDATE_EXPANSIONS = REGISTRY.register(Histogram(
+    "tweet_candidate_expansions", "Candidate expansions scored by the MLM per tweet.", COUNT_BUCKETS
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "classifier_batch_size", "Number of texts per classifier forward pass.", COUNT_BUCKETS
+))
+TOKENS = REGISTRY.register(Histogram(
+    "tweet_tokens", "Number of classifier tokens per tweet.", COUNT_BUCKETS
+))
+EXIT_LAYERS = REGISTRY.register(Histogram(
+    "classifier_exit_layers", "Number of encoder layers an early-exit classifier ran per tweet.", COUNT_BUCKETS
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_seconds", "Time spent handling each HTTP request."
+))
+
+
+# Decorates a function so its duration is recorded under the given stage.
+def timed(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,3 +1,6 @@
+import copy
+import hashlib
+import torch
 import torch.nn as nn
 from transformers import (
     BertPreTrainedModel,
@@ -9,6 +12,15 @@ from transformers import (
 )
 
 
+def model_fingerprint(model):
+    """Hashes a model's weights, so outputs cached for one checkpoint are never reused for another."""
+    digest = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
 class BertForSentimentClassification(BertPreTrainedModel):
     def __init__(self, config):
         super().__init__(config)
@@ -34,6 +46,84 @@ class BertForSentimentClassification(BertPreTrainedModel):
         return logits
 
 
+class BertForEarlyExitSentimentClassification(BertPreTrainedModel):
+    """
+    BERT with a classification head on the [CLS] representation after every encoder layer.
+    cls_layer is the last layer's head, so a trained BertForSentimentClassification loads
+    into it unchanged; exit_layers are the heads of the layers before it.
+
+    In training, every head is run and their logits are returned side by side, to be trained
+    jointly. In evaluation, each sequence stops at the first head whose probability is at
+    least exit_threshold sure either way, and only the remaining sequences go on to the next
+    layer, and the number of layers each sequence ran is returned with the logits.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        # BERT.
+        self.bert = BertModel(config)
+        # Classification layers of all but the last encoder layer.
+        self.exit_layers = nn.ModuleList(
+            nn.Linear(config.hidden_size, 1) for _ in range(config.num_hidden_layers - 1)
+        )
+        # Classification layer of the last encoder layer.
+        self.cls_layer = nn.Linear(config.hidden_size, 1)
+        self.exit_threshold = 0.9
+
+    def heads(self):
+        return list(self.exit_layers) + [self.cls_layer]
+
+    def forward(self, input_ids, attention_mask):
+        """
+        Inputs:
+                -input_ids : Tensor of shape [B, T] containing token ids of sequences
+                -attention_mask : Tensor of shape [B, T] containing attention masks to be used to avoid contibution of PAD tokens
+                (where B is the batch size and T is the input length)
+        Returns logits of shape [B, L] in training, one per layer L. In evaluation, returns logits of
+        shape [B, 1] and the number of layers each sequence ran, of shape [B].
+        """
+        if self.training:
+            outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+            # hidden_states starts with the embeddings, followed by the output of every layer.
+            return torch.cat(
+                [head(hidden[:, 0]) for head, hidden in zip(self.heads(), outputs.hidden_states[1:])], dim=-1
+            )
+
+        return self.forward_early_exit(input_ids, attention_mask)
+
+    # Runs the encoder layer by layer, dropping sequences from the batch as soon as a head is confident.
+    def forward_early_exit(self, input_ids, attention_mask):
+        batch_size = input_ids.shape[0]
+        hidden = self.bert.embeddings(input_ids=input_ids)
+        extended_mask = self.bert.get_extended_attention_mask(attention_mask, input_ids.shape)
+
+        logits = hidden.new_empty(batch_size, 1)
+        layers_executed = torch.full((batch_size,), self.config.num_hidden_layers, device=input_ids.device)
+        # Positions in the batch of the sequences still running.
+        active = torch.arange(batch_size, device=input_ids.device)
+
+        heads = self.heads()
+        for i, layer in enumerate(self.bert.encoder.layer):
+            hidden = layer(hidden, attention_mask=extended_mask)[0]
+            layer_logits = heads[i](hidden[:, 0])
+
+            if i == len(heads) - 1:
+                logits[active] = layer_logits
+                break
+
+            probabilities = torch.sigmoid(layer_logits.squeeze(-1))
+            exiting = torch.maximum(probabilities, 1 - probabilities) >= self.exit_threshold
+            logits[active[exiting]] = layer_logits[exiting]
+            layers_executed[active[exiting]] = i + 1
+
+            remaining = ~exiting
+            active, hidden, extended_mask = active[remaining], hidden[remaining], extended_mask[remaining]
+            if len(active) == 0:
+                break
+
+        return logits, layers_executed
+
+
 class AlbertForSentimentClassification(AlbertPreTrainedModel):
     def __init__(self, config):
         super().__init__(config)
@@ -71,4 +161,24 @@ class DistilBertForSentimentClassification(DistilBertPreTrainedModel):
         outputs = self.distilbert(input_ids=input_ids, attention_mask=attention_mask)
         cls_reps = outputs.last_hidden_state[:, 0]
         logits = self.cls_layer(cls_reps)
-        return logits
\ No newline at end of file
+        return logits
+
+
+def build_reduced_bert(teacher, num_layers):
+    """
+    Builds a BertForSentimentClassification with only num_layers encoder layers, to be
+    distilled from teacher. The student starts from the teacher's embeddings and
+    classification layer and from evenly spaced layers of its encoder.
+    """
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    student = BertForSentimentClassification(config)
+
+    # Copies everything except the encoder layers the student doesn't have.
+    student.load_state_dict(teacher.state_dict(), strict=False)
+
+    step = teacher.config.num_hidden_layers / num_layers
+    for i, layer in enumerate(student.bert.encoder.layer):
+        layer.load_state_dict(teacher.bert.encoder.layer[int(i * step)].state_dict())
+
+    return student
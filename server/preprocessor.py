@@ -1,101 +1,418 @@
-import pandas as pd
 import re
 import emoji
-import json
-import gensim.downloader as api
-from gensim.models import KeyedVectors
-import os
-import nltk
-from nltk.tokenize import word_tokenize
+import threading
+import time
 from itertools import product
-from transformers import AutoModelForMaskedLM, AutoTokenizer
 import torch
+import ast
+from functools import lru_cache
+from metrics import timed, CANDIDATE_EXPANSIONS
+
+APOSTROPHE_PATTERN = re.compile(r"[\']")
+URL_PATTERN = re.compile(r"http[s]?://\S+")
+MENTION_PATTERN = re.compile(r"@\w+")
+EMOTICON_PATTERN = re.compile(r"[:;=8xX][\'\-]?[)DpP/\\oO0*]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+HYPHEN_PATTERN = re.compile(r'([a-zA-Z])\-([a-zA-Z])')
+SPECIAL_CHARACTER_PATTERN = re.compile(r'[_`\"\-;%()|+&=*%.,!?:#$@[\]/]')
+# Emojis only contain non-ASCII characters, apart from the "#", "*" and digits of keycaps,
+# so emoji removal only needs to look at runs like these rather than every character.
+EMOJI_RUN_PATTERN = re.compile(r"[#*0-9]*[^\x00-\x7f]+")
+
+
+def remove_emojis(match):
+    return emoji.replace_emoji(match.group(0), replace="")
+
+
+@lru_cache(maxsize=None)
+def load_contractions(path="./contractions"):
+    """Parses the contractions file once per process and compiles a single-pass
+        matcher for the whitespace-delimited words that have more than one expansion.
+    """
+    with open(path, "r") as infile:
+        contractions = ast.literal_eval(infile.read())
+
+    ambiguous = sorted(
+        (word for word, options in contractions.items() if len(options) > 1),
+        key=len,
+        reverse=True,
+    )
+    ambiguous_pattern = re.compile(
+        r"(?<!\S)(?:" + "|".join(re.escape(word) for word in ambiguous) + r")(?!\S)",
+        re.IGNORECASE,
+    )
+
+    return contractions, ambiguous_pattern
 
 class Preprocessor:
-    def __init__(self):
+    def __init__(
+        self,
+        beam_width=4,
+        score_batch_size=16,
+        scoring="sentence",
+        context_window=5,
+        scoring_model_name_or_path="bert-base-uncased",
+        local_files_only=False,
+    ):
         print("=== SETTING UP PREPROCESSOR ===")
 
-        self.tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
-        self.model = AutoModelForMaskedLM.from_pretrained("bert-base-uncased")
-        nltk.download('punkt_tab')
+        # How expansions are scored: "sentence" uses the mean MLM logit of the whole
+        # candidate sentence, "local" only the masked contraction tokens in a window.
+        if scoring not in ("sentence", "local"):
+            raise ValueError(f"Unknown contraction scoring mode: {scoring}")
+        self.scoring = scoring
+        # Number of words either side of a contraction seen by "local" scoring.
+        self.context_window = context_window
+
+        # Number of partial expansions kept after each ambiguous contraction.
+        self.beam_width = beam_width
+        # Number of candidate sentences scored together in one MLM forward pass.
+        self.score_batch_size = score_batch_size
+
+        # The masked language model used to score expansions is only loaded the
+        # first time a text contains an ambiguous contraction.
+        self.scoring_model_name_or_path = scoring_model_name_or_path
+        self.local_files_only = local_files_only
+        self._tokenizer = None
+        self._model = None
+        self._scoring_model_lock = threading.Lock()
+
         self.load_contractions_dict()
 
         print("=== PREPROCESSOR READY ===")
 
+    @classmethod
+    def from_args(cls, args):
+        """Builds the preprocessor the contraction and scoring-model command-line options describe."""
+        return cls(
+            beam_width=args.contraction_beam_width,
+            scoring=args.contraction_scoring,
+            context_window=args.contraction_context_window,
+            scoring_model_name_or_path=args.scoring_model_name_or_path,
+            local_files_only=args.offline,
+        )
+
     def load_contractions_dict(self):
-        with open("./contractions", "r") as infile:
-            # ONLY LOAD TRUSTED FILES
-            contractions = eval(infile.read())
+        self.contractions, self.ambiguous_pattern = load_contractions()
+
+
+    def load_scoring_model(self):
+        """Loads the masked language model used to score expansions, if not loaded yet."""
+        with self._scoring_model_lock:
+            if self._model is not None:
+                return
+
+            start = time.perf_counter()
+            # Imported here so texts without ambiguous contractions never pay for transformers.
+            from transformers import AutoModelForMaskedLM, AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(
+                self.scoring_model_name_or_path, local_files_only=self.local_files_only
+            )
+            self._model = AutoModelForMaskedLM.from_pretrained(
+                self.scoring_model_name_or_path, local_files_only=self.local_files_only
+            )
+            self._model.eval()
+
+            print(f"Loaded contraction scoring model {self.scoring_model_name_or_path} in {time.perf_counter() - start:.2f}s")
+
 
-        self.contractions = contractions
+    @property
+    def tokenizer(self):
+        if self._model is None:
+            self.load_scoring_model()
+        return self._tokenizer
 
 
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_scoring_model()
+        return self._model
+
+
+    @timed("clean_text")
     def clean_text(self, text: str) -> str:
         # Remove hyperlinks
-        text = re.sub(r"http[s]?://\S+", "", text)
+        text = URL_PATTERN.sub("", text)
 
         # Remove user mentions (e.g., @username)
-        text = re.sub(r"@\w+", "", text)
+        text = MENTION_PATTERN.sub("", text)
 
         # Remove emojis
-        text = emoji.replace_emoji(text, replace="")
+        text = EMOJI_RUN_PATTERN.sub(remove_emojis, text)
 
         # Remove emoticons
-        emoticon_pattern = r"[:;=8xX][\'\-]?[)DpP/\\oO0*]"
-        text = re.sub(emoticon_pattern, "", text)
+        text = EMOTICON_PATTERN.sub("", text)
 
         # Replace multiple spaces with a single space
-        text = re.sub(r"\s+", " ", text).strip()
+        text = WHITESPACE_PATTERN.sub(" ", text).strip()
 
         # Replace hyphens within words with spaces (e.g., new-age -> new age)
-        text = re.sub(r'([a-zA-Z])\-([a-zA-Z])', r'\1 \2', text)
+        text = HYPHEN_PATTERN.sub(r'\1 \2', text)
 
         # Remove special characters
-        text = re.sub(r'[_`\"\-;%()|+&=*%.,!?:#$@[\]/]', '', text)
+        text = SPECIAL_CHARACTER_PATTERN.sub('', text)
 
         return text
 
 
+    def clean_texts(self, texts):
+        """Applies the clean_text steps to a whole pandas Series of strings at once."""
+        texts = texts.str.replace(URL_PATTERN, "", regex=True)
+        texts = texts.str.replace(MENTION_PATTERN, "", regex=True)
+        texts = texts.str.replace(EMOJI_RUN_PATTERN, remove_emojis, regex=True)
+        texts = texts.str.replace(EMOTICON_PATTERN, "", regex=True)
+        texts = texts.str.replace(WHITESPACE_PATTERN, " ", regex=True).str.strip()
+        texts = texts.str.replace(HYPHEN_PATTERN, r"\1 \2", regex=True)
+        texts = texts.str.replace(SPECIAL_CHARACTER_PATTERN, "", regex=True)
+
+        return texts
+
+
+    def score_sentences(self, sentences):
+        """Scores sentences using BERT, in padded batches of score_batch_size."""
+        scores = []
+        for start in range(0, len(sentences), self.score_batch_size):
+            batch = sentences[start:start + self.score_batch_size]
+            inputs = self.tokenizer(batch, padding=True, return_tensors="pt")
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+            # Calculate the mean logit score over the real (non-padding) tokens as a proxy for sentence quality
+            token_scores = outputs.logits.mean(dim=-1)
+            mask = inputs["attention_mask"].to(token_scores.dtype)
+            sentence_scores = (token_scores * mask).sum(dim=-1) / mask.sum(dim=-1)
+            scores.extend(sentence_scores.tolist())
+        return scores
+
+
     def score_sentence(self, sentence):
         """Scores a sentence using BERT."""
-        inputs = self.tokenizer(sentence, return_tensors="pt")
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        # Calculate the mean logit score as a proxy for sentence quality
-        logits = outputs.logits[0]
-        sentence_score = logits.mean().item()
-        return sentence_score
+        return self.score_sentences([sentence])[0]
+
+
+    @timed("expand_contractions")
+    def expansion_options(self, text):
+        """Lists the possible replacements for each word (allowing for double contractions)"""
+        return [self.contractions.get(word.lower(), [word.lower()]) for word in text.split()]
+
+
+    def join_expansion(self, words):
+        """Joins the chosen replacements into a sentence, removing apostrophes"""
+        return APOSTROPHE_PATTERN.sub("", " ".join(words))
 
 
     def expand_contractions(self, text):
         """Expands contractions based on context, also removes unneeded characters
             We remove special characters after expansion as contractions like "couldn't" need the apostrophe to be expanded
         """
-        words = text.split()
-        
-        # Create a list of possible replacements for each word (allowing for double contractions)
-        expanded_options = [self.contractions.get(word.lower(), [word.lower()]) for word in words]
+        expanded_options = self.expansion_options(text)
 
         # Generate all possible sentence combinations, removing apostrophes
-        candidate_sentences = [re.sub(r'[\']', '', " ".join(sentence)) for sentence in product(*expanded_options)]
+        candidate_sentences = [self.join_expansion(sentence) for sentence in product(*expanded_options)]
 
         return candidate_sentences
 
+    @timed("select_best_expansion")
     def select_best_expansion(self, candidate_sentences):
-        # Score each candidate sentence
-        scored_sentences = [(sent, self.score_sentence(sent)) for sent in candidate_sentences]
+        CANDIDATE_EXPANSIONS.observe(len(candidate_sentences))
+
+        # Score all candidate sentences in batches
+        scores = self.score_sentences(candidate_sentences)
 
         # Select the best scoring sentence
-        best_sentence = max(scored_sentences, key=lambda x: x[1])[0]
-        return best_sentence
+        best_index = max(range(len(candidate_sentences)), key=lambda i: scores[i])
+        return candidate_sentences[best_index]
+
+
+    def masked_lm_head(self):
+        """Returns the scoring model's MLM head if it is one module mapping encoder hidden
+            states to vocabulary logits (BERT's cls, RoBERTa's lm_head, ALBERT's predictions),
+            or None if the head can only be run as part of the whole model.
+        """
+        for name in ("cls", "lm_head", "predictions"):
+            head = getattr(self.model, name, None)
+            if isinstance(head, torch.nn.Module):
+                return head
+        return None
+
+
+    def score_local_options(self, candidates, sites):
+        """Scores the expansion chosen at each candidate word list's contraction site.
+            Only context_window words either side of the site are fed to BERT, the expansion's
+            tokens are masked, and the score is the mean log-probability BERT gives them.
+            Where masked_lm_head allows, the MLM head is only applied at the masked positions.
+        """
+        mask_id = self.tokenizer.mask_token_id
+
+        sequences, targets = [], []
+        for words, site in zip(candidates, sites):
+            left = self.join_expansion(words[max(0, site - self.context_window):site])
+            option = self.join_expansion(words[site:site + 1])
+            right = self.join_expansion(words[site + 1:site + 1 + self.context_window])
+
+            left_ids = self.tokenizer.encode(left, add_special_tokens=False)
+            option_ids = self.tokenizer.encode(option, add_special_tokens=False)
+            right_ids = self.tokenizer.encode(right, add_special_tokens=False)
+
+            sequences.append(
+                [self.tokenizer.cls_token_id] + left_ids + [mask_id] * len(option_ids)
+                + right_ids + [self.tokenizer.sep_token_id]
+            )
+            targets.append(
+                [(1 + len(left_ids) + i, token_id) for i, token_id in enumerate(option_ids)]
+            )
+
+        scores = []
+        for start in range(0, len(sequences), self.score_batch_size):
+            batch = sequences[start:start + self.score_batch_size]
+            batch_targets = targets[start:start + self.score_batch_size]
+
+            longest = max(len(sequence) for sequence in batch)
+            input_ids = torch.tensor(
+                [sequence + [self.tokenizer.pad_token_id] * (longest - len(sequence)) for sequence in batch]
+            )
+            attention_mask = torch.tensor(
+                [[1] * len(sequence) + [0] * (longest - len(sequence)) for sequence in batch]
+            )
+            rows = [row for row, t in enumerate(batch_targets) for _ in t]
+            positions = [position for t in batch_targets for position, _ in t]
+            head = self.masked_lm_head()
+            with torch.no_grad():
+                if head is not None:
+                    # Run the encoder, then the MLM head only on the masked positions
+                    hidden = self.model.base_model(
+                        input_ids=input_ids, attention_mask=attention_mask
+                    ).last_hidden_state
+                    logits = head(hidden[rows, positions])
+                else:
+                    # The head isn't a single module (e.g. DistilBERT), so run the whole model
+                    logits = self.model(
+                        input_ids=input_ids, attention_mask=attention_mask
+                    ).logits[rows, positions]
+                log_probs = torch.log_softmax(logits, dim=-1)
+
+            token_ids = torch.tensor([token_id for t in batch_targets for _, token_id in t])
+            token_scores = log_probs[torch.arange(len(token_ids)), token_ids].tolist()
+
+            offset = 0
+            for t in batch_targets:
+                # An expansion with no tokens can't be scored, so never prefer it
+                option_scores = token_scores[offset:offset + len(t)]
+                scores.append(sum(option_scores) / len(t) if t else float("-inf"))
+                offset += len(t)
+
+        return scores
+
+
+    def search_best_expansion(self, expanded_options):
+        """Picks the best expansion one ambiguous contraction at a time, keeping only
+            the beam_width best partial expansions, so the number of MLM passes grows
+            linearly rather than exponentially with the number of contractions.
+            Contractions that are not decided yet keep their first option.
+        """
+        return self.search_best_expansions([expanded_options])[0]
+
+
+    @timed("select_best_expansion")
+    def search_best_expansions(self, expanded_options_list):
+        """Runs search_best_expansion for several texts in lockstep: each step decides the
+            next ambiguous contraction of every text that has one left, and the candidates
+            of all those texts are scored together in shared MLM batches.
+        """
+        beams = [
+            [(0.0, [options[0] for options in expanded_options])]
+            for expanded_options in expanded_options_list
+        ]
+        sites = [
+            [site for site, options in enumerate(expanded_options) if len(options) > 1]
+            for expanded_options in expanded_options_list
+        ]
+        num_candidates = [0] * len(expanded_options_list)
+
+        for step in range(max((len(text_sites) for text_sites in sites), default=0)):
+            # Extend every kept partial expansion with each option at the text's next site
+            candidates = []
+            for i, expanded_options in enumerate(expanded_options_list):
+                if step >= len(sites[i]):
+                    continue
+
+                site = sites[i][step]
+                text_candidates = {}
+                for beam_score, beam in beams[i]:
+                    for option in expanded_options[site]:
+                        words = beam[:site] + [option] + beam[site + 1:]
+                        text_candidates.setdefault(self.join_expansion(words), (beam_score, words))
+
+                num_candidates[i] += len(text_candidates)
+                candidates.extend(
+                    (i, site, sentence, beam_score, words)
+                    for sentence, (beam_score, words) in text_candidates.items()
+                )
+
+            if self.scoring == "local":
+                # Site scores are log-probabilities, so they add up along the beam
+                site_scores = self.score_local_options(
+                    [words for _, _, _, _, words in candidates],
+                    [site for _, site, _, _, _ in candidates],
+                )
+                scores = [
+                    beam_score + site_score
+                    for (_, _, _, beam_score, _), site_score in zip(candidates, site_scores)
+                ]
+            else:
+                scores = self.score_sentences([sentence for _, _, sentence, _, _ in candidates])
+
+            scored = {}
+            for (i, _, _, _, words), score in zip(candidates, scores):
+                scored.setdefault(i, []).append((score, words))
+
+            for i, text_scored in scored.items():
+                beams[i] = sorted(text_scored, key=lambda beam: beam[0], reverse=True)[:self.beam_width]
+
+        for count in num_candidates:
+            CANDIDATE_EXPANSIONS.observe(count)
+
+        return [self.join_expansion(text_beams[0][1]) for text_beams in beams]
 
 
     def preprocess_sample(self, text: str) -> None:
         text = self.clean_text(text)
-        sentences = self.expand_contractions(text)
-        corrected = self.select_best_expansion(sentences)
 
-        return corrected
+        return self.disambiguate(text)
+
+
+    def disambiguate(self, text):
+        """Expands the contractions of an already cleaned text"""
+        return self.disambiguate_batch([text])[0]
+
+
+    def disambiguate_batch(self, texts):
+        """Expands the contractions of several cleaned texts, scoring the candidates
+            of all texts with ambiguous contractions together.
+        """
+        expanded_options_list = [self.expansion_options(text) for text in texts]
+        results = [None] * len(texts)
+
+        # Only texts with an ambiguous contraction need BERT to choose an expansion
+        ambiguous = []
+        for i, (text, expanded_options) in enumerate(zip(texts, expanded_options_list)):
+            if self.ambiguous_pattern.search(text) is None:
+                CANDIDATE_EXPANSIONS.observe(0)
+                results[i] = self.join_expansion([options[0] for options in expanded_options])
+            else:
+                ambiguous.append(i)
+
+        if ambiguous:
+            corrected = self.search_best_expansions([expanded_options_list[i] for i in ambiguous])
+            for i, text in zip(ambiguous, corrected):
+                results[i] = text
+
+        return results
+
+
+    def preprocess_batch(self, texts):
+        return self.disambiguate_batch([self.clean_text(text) for text in texts])
 
 
     def test_preprocessing(self):
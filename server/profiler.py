@@ -0,0 +1,35 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Samples the Python stacks of every other thread every interval seconds for the
+    given duration, and returns them in collapsed-stack format (one
+    "frame;frame;frame count" line per distinct stack, hottest first), which
+    flamegraph tools read directly.
+    """
+    own_thread = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = Counter()
+
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            frames.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(frames))] += 1
+
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,70 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batcher import Overloaded, DeadlineExceeded, wait_until
+
+logger = logging.getLogger("requests")
+
+
+class ModelExecutor:
+    """
+    Runs model work (e.g. contraction disambiguation) on a dedicated pool of threads,
+    so request threads only wait on it.
+
+    At most max_workers + max_queue_size jobs can be queued or running; further jobs
+    are refused with Overloaded. Jobs whose deadline has passed by the time a worker
+    picks them up are dropped instead of being run.
+    """
+
+    def __init__(self, max_workers=2, max_queue_size=256):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="model"
+        )
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+
+    # Runs fn(*args) on the executor and waits for its result until the deadline.
+    def run(self, fn, *args, deadline=None):
+        if not self.slots.acquire(blocking=False):
+            raise Overloaded()
+
+        def job():
+            try:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise DeadlineExceeded()
+                return fn(*args)
+            finally:
+                self.slots.release()
+
+        return wait_until(self.executor.submit(job), deadline)
+
+
+class RequestLogger:
+    """Writes one JSON line per request for a random sample_rate of requests; errors are always logged."""
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+
+    def log(self, method, path, status, latency, **fields):
+        if status < 400 and random.random() >= self.sample_rate:
+            return
+
+        logger.info(json.dumps({
+            "method": method,
+            "path": path,
+            "status": status,
+            "latency_ms": round(latency * 1000, 2),
+            **fields,
+        }))
+
+
+# Serves a WSGI app from waitress's pool of request threads instead of Flask's development server,
+# so concurrent requests run side by side and can share the micro-batcher's forward passes.
+def run_production(app, host, port, threads):
+    # Imported here so it is only needed in production mode.
+    import waitress
+
+    waitress.serve(app, host=host, port=port, threads=threads)
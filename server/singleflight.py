@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from batcher import DeadlineExceeded, wait_until
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key.
+
+    The first caller for a key runs the work; callers that arrive with the same key
+    while it is still running wait on the same future and get the same result
+    (or exception) instead of repeating the work.
+
+    The one exception that isn't shared is DeadlineExceeded: the leader's deadline says
+    nothing about a follower's, so followers with time left call again instead.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+        self.coalesced = 0
+
+    # Runs fn() unless a call with the same key is already in flight, then returns its result.
+    # The deadline is a time.monotonic() value, or None for callers that never give up.
+    def do(self, key, fn, deadline=None):
+        while True:
+            with self.lock:
+                future = self.calls.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = Future()
+                    self.calls[key] = future
+                else:
+                    self.coalesced += 1
+
+            if is_leader:
+                break
+
+            try:
+                return wait_until(future, deadline)
+            except DeadlineExceeded:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+        try:
+            result, error = fn(), None
+        except Exception as e:
+            result, error = None, e
+        finally:
+            # Forget the call before resolving it, so followers that call again start a new one.
+            with self.lock:
+                del self.calls[key]
+
+        if error is not None:
+            future.set_exception(error)
+            raise error
+
+        future.set_result(result)
+        return result
@@ -0,0 +1,210 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+from arguments import args
+from dataset import ModyDataset, load_split, save_split
+from train import run_training
+from workers import available_cores
+
+
+# Reads the search space from a JSON string or a JSON file, checking it only names train.py arguments.
+def load_space(spec):
+    if os.path.exists(spec):
+        with open(spec) as infile:
+            space = json.load(infile)
+    else:
+        space = json.loads(spec)
+
+    for name in space:
+        if name not in vars(args):
+            raise ValueError(f"{name} in the sweep space is not an argument of train.py.")
+
+    return space
+
+
+# Every combination of the values in the search space.
+def grid_trials(space):
+    for name, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f"A grid sweep needs a list of values for {name}.")
+
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+
+# Draws one value from a list of choices, or from a {"low", "high", "log"} range.
+def sample_value(rng, values):
+    if isinstance(values, list):
+        return rng.choice(values)
+
+    low, high = values["low"], values["high"]
+    if values.get("log", False):
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if isinstance(low, int) and isinstance(high, int):
+        return rng.randint(low, high)
+    return rng.uniform(low, high)
+
+
+def random_trials(space, num_trials, seed):
+    rng = random.Random(seed)
+    return [{name: sample_value(rng, values) for name, values in space.items()} for _ in range(num_trials)]
+
+
+# The train.py arguments of a trial, which saves its model to its own directory under --output_dir.
+def trial_args(index, params):
+    return argparse.Namespace(**{
+        **vars(args),
+        **params,
+        "output_dir": os.path.join(args.output_dir, f"trial-{index:03d}"),
+        "distributed": False,
+    })
+
+
+# The model whose tokenizer run_training tokenizes a trial's split with.
+def tokenizer_name_or_path(trial):
+    if trial.teacher_model_name_or_path is not None and trial.student_layers is not None:
+        # The reduced student is a copy of the teacher, saved with the teacher's tokenizer.
+        return trial.teacher_model_name_or_path
+    return trial.model_name_or_path or "bert-base-uncased"
+
+
+def prepare_datasets(trials, split):
+    """
+    Tokenizes the split once for every tokenizer and maximum length the trials use, so
+    trials only memory-map ModyDataset's cache instead of each tokenizing it again.
+    Distilling trials also need the training split tokenized for their teacher.
+    """
+    train_df, val_df = split
+    tokenizers, prepared = {}, set()
+
+    for index, params in enumerate(trials):
+        trial = trial_args(index, params)
+        needed = [
+            (tokenizer_name_or_path(trial), "train", train_df, trial.maxlen_train),
+            (tokenizer_name_or_path(trial), "val", val_df, trial.maxlen_val),
+        ]
+        if trial.teacher_model_name_or_path is not None:
+            needed.append((trial.teacher_model_name_or_path, "train", train_df, trial.maxlen_train))
+
+        for name_or_path, name, df, maxlen in needed:
+            if (name_or_path, name, maxlen) in prepared:
+                continue
+
+            if name_or_path not in tokenizers:
+                tokenizers[name_or_path] = AutoTokenizer.from_pretrained(
+                    name_or_path, local_files_only=trial.offline
+                )
+            ModyDataset(maxlen=maxlen, tokenizer=tokenizers[name_or_path], dataframe=df)
+            prepared.add((name_or_path, name, maxlen))
+
+
+# Returns a should_stop(epoch, val_accuracy) for run_training that records the trial's first-epoch
+# accuracy and stops it if that is more than margin below the best recorded by earlier trials.
+def first_epoch_pruner(first_epoch_accuracies, margin):
+    def should_stop(epoch, val_accuracy):
+        if epoch > 0:
+            return False
+        previous = first_epoch_accuracies[:]
+        first_epoch_accuracies.append(val_accuracy)
+        return len(previous) > 0 and val_accuracy < max(previous) - margin
+
+    return should_stop
+
+
+def run_trial(task):
+    """
+    Trains one trial in a pool process with its share of the cores, for torch's threads and
+    for DataLoader workers, on the split the parent saved to split_path. After its first
+    evaluation, the trial stops if its accuracy is more than --sweep_prune_margin below the
+    best first-epoch accuracy of the trials before it. Returns its row of the results table.
+    """
+    index, params, first_epoch_accuracies, num_threads, num_loader_workers, split_path = task
+    torch.set_num_threads(num_threads)
+
+    # A trial's own num_threads, if the space sets one, wins over its share.
+    trial = trial_args(index, {"num_threads": num_loader_workers, **params})
+    row = {"trial": index, **params, "output_dir": f"models/{trial.output_dir}/"}
+
+    start = time.perf_counter()
+    try:
+        results = run_training(
+            trial, split_path=split_path,
+            should_stop=first_epoch_pruner(first_epoch_accuracies, args.sweep_prune_margin),
+        )
+    except Exception as error:
+        # One bad configuration, e.g. a batch size that runs out of memory, shouldn't end the sweep.
+        return {**row, "error": repr(error), "wall_seconds": time.perf_counter() - start}
+
+    return {
+        **row,
+        "accuracy": results["accuracy"],
+        "epochs": results["epochs"],
+        "stopped_early": results["epochs"] < trial.num_eps,
+        "wall_seconds": time.perf_counter() - start,
+        "samples_per_sec": results["samples_per_sec"],
+    }
+
+
+# Writes the results so far, best accuracy first.
+def write_results(rows, path):
+    results = pd.DataFrame(rows)
+    if "accuracy" in results:
+        results = results.sort_values("accuracy", ascending=False)
+    results.to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    if args.sweep_space is None:
+        raise ValueError("Pass the search space with --sweep_space.")
+
+    space = load_space(args.sweep_space)
+    if args.sweep_mode == "grid":
+        trials = grid_trials(space)
+    else:
+        trials = random_trials(space, args.sweep_trials, args.sweep_seed)
+
+    # Split and tokenize the data once before any trial starts; trials read the saved split back.
+    split = load_split()
+    split_path = save_split(split)
+    prepare_datasets(trials, split)
+
+    num_workers = min(args.sweep_workers, len(trials))
+    num_threads = max(1, available_cores() // num_workers)
+    num_loader_workers = args.num_threads // num_workers
+    print(
+        f"Running {len(trials)} trials, {num_workers} at a time with {num_threads} threads "
+        f"and {num_loader_workers} DataLoader workers each"
+    )
+
+    # Trials run in fresh spawned processes, so none inherits another's threads or model. Unlike
+    # multiprocessing.Pool's daemonic processes, the executor's may start DataLoader workers.
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    with context.Manager() as manager, ProcessPoolExecutor(
+        num_workers, mp_context=context, max_tasks_per_child=1
+    ) as pool:
+        first_epoch_accuracies = manager.list()
+        tasks = [
+            (index, params, first_epoch_accuracies, num_threads, num_loader_workers, split_path)
+            for index, params in enumerate(trials)
+        ]
+
+        for future in as_completed([pool.submit(run_trial, task) for task in tasks]):
+            row = future.result()
+            rows.append(row)
+            write_results(rows, args.sweep_output)
+            print(f"Trial {row['trial']} finished ({len(rows)}/{len(trials)}): {row}")
+
+    print(f"Wrote {len(rows)} trials to {args.sweep_output}")
+    best = pd.read_csv(args.sweep_output).iloc[0]
+    print(f"Best trial : {best.to_dict()}")
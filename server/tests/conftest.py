@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The server modules import each other by name, and arguments.py parses the command
+# line on import, so give it only the program name instead of pytest's arguments.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.argv = sys.argv[:1]
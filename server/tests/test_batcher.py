@@ -0,0 +1,109 @@
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from batcher import DeadlineExceeded, MicroBatcher, Overloaded, collect_batch
+
+
+class FakeClassifier:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def classify_sentiment_batch(self, texts):
+        self.release.wait()
+        time.sleep(self.delay)
+        self.batches.append(list(texts))
+        return [len(text) for text in texts]
+
+
+def test_concurrent_texts_share_a_forward_pass():
+    classifier = FakeClassifier()
+    batcher = MicroBatcher(classifier, max_batch_size=8, max_wait_ms=200)
+
+    futures = [batcher.submit(f"text {i}" + "!" * i) for i in range(5)]
+
+    assert [future.result(timeout=5) for future in futures] == [6 + i for i in range(5)]
+    assert classifier.batches == [[f"text {i}" + "!" * i for i in range(5)]]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    classifier = FakeClassifier()
+    batcher = MicroBatcher(classifier, max_batch_size=2, max_wait_ms=200)
+
+    futures = [batcher.submit(str(i)) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+
+    assert [len(batch) for batch in classifier.batches] == [2, 2, 1]
+
+
+def test_full_queue_is_refused():
+    classifier = FakeClassifier()
+    classifier.release.clear()
+    batcher = MicroBatcher(classifier, max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+
+    # The worker takes the first text and blocks in the model, the second fills the queue.
+    first = batcher.submit("a")
+    while batcher.queue_depth() > 0:
+        time.sleep(0.001)
+    batcher.submit("b")
+
+    with pytest.raises(Overloaded):
+        batcher.submit("c")
+
+    classifier.release.set()
+    assert first.result(timeout=5) == 1
+
+
+def test_expired_texts_skip_the_model():
+    classifier = FakeClassifier()
+    batcher = MicroBatcher(classifier, max_batch_size=8, max_wait_ms=0)
+
+    with pytest.raises(DeadlineExceeded):
+        batcher.submit("late", deadline=time.monotonic() - 1).result(timeout=5)
+    assert batcher.classify("on time", deadline=time.monotonic() + 5) == 7
+
+    assert classifier.batches == [["on time"]]
+
+
+def test_classify_gives_up_at_the_deadline():
+    classifier = FakeClassifier(delay=0.5)
+    batcher = MicroBatcher(classifier, max_batch_size=8, max_wait_ms=0)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        batcher.classify("slow", deadline=start + 0.1)
+    assert time.monotonic() - start < 0.4
+
+
+def test_model_errors_fail_the_batch_but_not_the_worker():
+    class FailingOnce(FakeClassifier):
+        def classify_sentiment_batch(self, texts):
+            if not self.batches:
+                self.batches.append(None)
+                raise RuntimeError("boom")
+            return super().classify_sentiment_batch(texts)
+
+    batcher = MicroBatcher(FailingOnce(), max_batch_size=8, max_wait_ms=0)
+
+    with pytest.raises(RuntimeError):
+        batcher.classify("first")
+    assert batcher.classify("second") == 6
+
+
+def test_collect_batch_splits_off_expired_items():
+    queue = Queue()
+    now = time.monotonic()
+    for item in [("a", None), ("b", now - 1), ("c", now + 60), ("d", None)]:
+        queue.put(item)
+
+    live, expired = collect_batch(queue, 3, 0.05, lambda item: item[1])
+
+    assert [text for text, _ in live] == ["a", "c"]
+    assert [text for text, _ in expired] == ["b"]
+    assert queue.qsize() == 1
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from batcher import DeadlineExceeded
+from cache import ResultCache
+from singleflight import SingleFlight
+
+
+def test_hits_misses_and_lru_eviction():
+    cache = ResultCache(max_size=2, ttl=0)
+    a, b, c = (cache.key(text) for text in ["a", "b", "c"])
+
+    assert cache.get(a) is None
+    cache.put(a, ("a", 0))
+    cache.put(b, ("b", 1))
+    assert cache.get(a) == ("a", 0)
+
+    # b is now the least recently used entry.
+    cache.put(c, ("c", 0))
+    assert cache.get(b) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (1, 2, 1, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_keys_ignore_case_but_not_namespace():
+    assert ResultCache().key("Hello") == ResultCache().key("hello")
+    assert ResultCache(namespace="bert").key("hello") != ResultCache(namespace="albert").key("hello")
+
+
+def test_expired_entries_are_misses():
+    cache = ResultCache(ttl=0.05)
+    key = cache.key("a")
+    cache.put(key, ("a", 0))
+    time.sleep(0.1)
+
+    assert cache.get(key) is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    writer = ResultCache(path=path)
+    key = writer.key("a")
+    writer.put(key, ("a", 1))
+    writer.flush()
+
+    cache = ResultCache(path=path)
+    assert cache.get(key) == ("a", 1)
+    assert cache.get(key) == ("a", 1)
+    assert (cache.stats()["disk_hits"], cache.stats()["hits"]) == (1, 1)
+
+
+def test_expired_rows_are_deleted_from_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    writer = ResultCache(ttl=0.05, path=path)
+    for text in ["a", "b"]:
+        writer.put(writer.key(text), (text, 0))
+    writer.flush()
+    time.sleep(0.1)
+
+    reader = ResultCache(ttl=0.05, path=path)
+    assert reader.db.execute("SELECT COUNT(*) FROM results").fetchone() == (0,)
+    assert reader.db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_recheck_does_not_count_a_second_miss():
+    cache = ResultCache()
+    key = cache.key("a")
+
+    assert cache.get(key) is None
+    assert cache.get(key, count_miss=False) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_single_flight_shares_one_call():
+    in_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(in_flight.do("key", work)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(in_flight.do("key", work))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while in_flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert in_flight.coalesced == 3
+
+    # Once the call is done, the next one for the same key runs again.
+    assert in_flight.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_shares_errors_and_forgets_the_key():
+    in_flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        in_flight.do("key", fail)
+    assert in_flight.calls == {}
+
+
+def test_followers_with_time_left_retry_after_the_leaders_deadline():
+    in_flight = SingleFlight()
+    started = threading.Event()
+    calls = []
+
+    def expire():
+        calls.append("leader")
+        started.set()
+        time.sleep(0.2)
+        raise DeadlineExceeded()
+
+    def work():
+        calls.append("follower")
+        return "result"
+
+    leader = threading.Thread(target=lambda: pytest.raises(DeadlineExceeded, in_flight.do, "key", expire))
+    leader.start()
+    started.wait(5)
+
+    # This follower would wait past its own deadline, the other still has time after the leader fails.
+    with pytest.raises(DeadlineExceeded):
+        in_flight.do("key", work, deadline=time.monotonic() + 0.05)
+    assert in_flight.do("key", work, deadline=time.monotonic() + 5) == "result"
+
+    leader.join(5)
+    assert calls == ["leader", "follower"]
@@ -0,0 +1,68 @@
+import argparse
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from transformers import BertConfig, BertTokenizerFast
+
+from classifier import Classifier, EarlyExitLoss
+from model import BertForSentimentClassification
+
+WORDS = ["you", "are", "great", "awful", "people"]
+
+
+# Saves a tiny randomly-initialized BERT classifier and its tokenizer, returning the directory.
+def save_tiny_bert(path, num_hidden_layers):
+    with open(path / "vocab.txt", "w") as outfile:
+        outfile.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n")
+    BertTokenizerFast(vocab_file=str(path / "vocab.txt")).save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(WORDS) + 5, hidden_size=16, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=2, intermediate_size=32,
+    )
+    BertForSentimentClassification(config).save_pretrained(path)
+    return str(path)
+
+
+def load_early_exit_classifier(model_name_or_path):
+    return Classifier(for_training=True, args=argparse.Namespace(
+        model_name_or_path=model_name_or_path, early_exit=True, exit_threshold=0.9,
+        inference_backend="eager", offline=True, output_dir="unused",
+        bf16=False, compile=False, grad_accum_steps=1, distributed=False,
+    ))
+
+
+@pytest.mark.parametrize("num_hidden_layers", [1, 3])
+def test_early_exit_models_train_with_any_number_of_layers(tmp_path, num_hidden_layers):
+    classifier = load_early_exit_classifier(save_tiny_bert(tmp_path, num_hidden_layers))
+
+    encoded = classifier.tokenizer(["you are great", "awful people"], padding=True, return_tensors="pt")
+    batch = (encoded["input_ids"], encoded["attention_mask"], torch.tensor([0, 1]))
+
+    stats = classifier.train(
+        train_loader=[batch, batch],
+        optimizer=optim.Adam(classifier.model.parameters()),
+        criterion=EarlyExitLoss(nn.BCEWithLogitsLoss()),
+    )
+    assert stats["samples_per_sec"] > 0
+
+    classifier.model.train()
+    logits = classifier.model(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+    assert logits.shape == (2, num_hidden_layers)
+
+
+def test_early_exit_counts_are_returned_with_the_logits(tmp_path):
+    classifier = load_early_exit_classifier(save_tiny_bert(tmp_path, 3))
+    classifier.model.eval()
+
+    encoded = classifier.tokenizer(["you are great", "awful people", "people"], padding=True, return_tensors="pt")
+    logits, layers_executed = classifier.forward(encoded["input_ids"], encoded["attention_mask"])
+
+    assert logits.shape == (3, 1)
+    assert layers_executed.shape == (3,)
+    assert all(1 <= layers <= 3 for layers in layers_executed.tolist())
+    assert not hasattr(classifier.model, "last_layers_executed")
+    assert len(classifier.predict_probabilities(["you are great", "people"])) == 2
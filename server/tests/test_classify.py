@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+
+import pandas as pd
+import pytest
+
+from arguments import args
+from classifier import get_decision_from_probability
+from classify import classify_file, load_checkpoint
+
+
+class FakePreprocessor:
+    def load_scoring_model(self):
+        pass
+
+    def clean_texts(self, texts):
+        return texts.str.lower()
+
+    def disambiguate_batch(self, texts):
+        return texts
+
+
+class FakeClassifier:
+    def __init__(self, crash_at_row=None):
+        self.crash_at_row = crash_at_row
+
+    def predict_probabilities(self, texts):
+        if self.crash_at_row is not None and f"tweet {self.crash_at_row}" in texts:
+            # Die the way a killed process does, without cleaning anything up.
+            os._exit(1)
+        return [int(text.split()[1]) % 10 / 10 for text in texts]
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    for name, value in {
+        "chunk_size": 10,
+        "max_batch_size": 4,
+        "preprocess_workers": 1,
+        "preprocess_batch_size": 4,
+        "text_column": "text",
+        "id_column": "id",
+    }.items():
+        monkeypatch.setattr(args, name, value)
+
+    input_path = str(tmp_path / "tweets.csv")
+    pd.DataFrame({"id": range(100, 145), "text": [f"Tweet {i}" for i in range(45)]}).to_csv(input_path, index=False)
+    output_path = str(tmp_path / "classified.csv")
+    return input_path, output_path, f"{output_path}.checkpoint"
+
+
+def expected_output():
+    probabilities = [i % 10 / 10 for i in range(45)]
+    return pd.DataFrame({
+        "id": range(100, 145),
+        "probability": probabilities,
+        "decision": [get_decision_from_probability(p) for p in probabilities],
+    })
+
+
+def run(paths, crash_at_row=None):
+    classify_file(FakePreprocessor(), FakeClassifier(crash_at_row), *paths)
+
+
+def test_killed_run_resumes_where_it_stopped(paths):
+    input_path, output_path, checkpoint_path = paths
+
+    process = multiprocessing.get_context("fork").Process(target=run, args=(paths, 32))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 1
+
+    # The chunks before the one being classified were checkpointed.
+    assert load_checkpoint(checkpoint_path, input_path)["rows"] == 30
+
+    # Rows written after the last checkpoint must not survive the restart.
+    with open(output_path, "a") as outfile:
+        outfile.write("999,0.5,0\n")
+
+    run(paths)
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), expected_output())
+    assert load_checkpoint(checkpoint_path, input_path)["rows"] == 45
+
+
+def test_fresh_run_replaces_a_stale_output(paths):
+    _, output_path, _ = paths
+    with open(output_path, "w") as outfile:
+        outfile.write("id,probability,decision\n1,0.9,1\n")
+
+    run(paths)
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), expected_output())
+
+
+def test_checkpoint_without_its_output_starts_over(paths):
+    _, output_path, _ = paths
+    run(paths)
+    os.remove(output_path)
+
+    run(paths)
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), expected_output())
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from transformers import BertTokenizerFast
+
+from dataset import ModyDataset, atomic_write, dataframe_fingerprint, load_split, make_loader, save_split
+
+WORDS = ["you", "are", "great", "awful", "people", "so"]
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    # ModyDataset caches its encodings under ./data/cache.
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "vocab.txt").write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n")
+    tokenizer = BertTokenizerFast(vocab_file=str(tmp_path / "vocab.txt"))
+
+    sentences = [" ".join(WORDS[:1 + i % len(WORDS)]) for i in range(64)]
+    df = pd.DataFrame({"sentence": sentences, "label": [i % 2 for i in range(64)]})
+    return ModyDataset(maxlen=10, tokenizer=tokenizer, dataframe=df)
+
+
+def epoch_order(loader):
+    return [tuple(input_ids[:, 1].tolist()) + tuple(labels.tolist()) for input_ids, _, labels in loader]
+
+
+@pytest.mark.parametrize("bucket_by_length", [False, True])
+def test_shuffle_means_the_same_on_every_path(dataset, bucket_by_length):
+    fixed = make_loader(dataset, 8, 0, bucket_by_length=bucket_by_length)
+    assert epoch_order(fixed) == epoch_order(fixed)
+
+    shuffled = make_loader(dataset, 8, 0, bucket_by_length=bucket_by_length, shuffle=True)
+    # Every pass over the loader is a new epoch in a new order.
+    assert epoch_order(shuffled) != epoch_order(shuffled)
+    assert sorted(sum((list(labels.tolist()) for _, _, labels in shuffled), [])) == sorted(dataset.labels)
+
+
+def test_interrupted_writes_keep_the_previous_file(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    with atomic_write(str(path), "w") as outfile:
+        outfile.write("old")
+
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_write(str(path), "w") as outfile:
+            outfile.write("partial")
+            raise KeyboardInterrupt
+
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["checkpoint.json"]
+
+
+def test_saved_splits_read_back_unchanged(tmp_path):
+    df = pd.DataFrame({"sentence": [f"tweet {i}" for i in range(10)], "label": [i % 2 for i in range(10)]})
+    split = (df.iloc[[3, 1, 7, 0, 9, 4, 6, 2]], df.iloc[[8, 5]])
+
+    path = save_split(split, cache_dir=str(tmp_path))
+    assert save_split(split, cache_dir=str(tmp_path)) == path
+
+    for saved, loaded in zip(split, load_split(path)):
+        # Same rows in the same order, so ModyDataset finds the encodings cached from the original.
+        assert dataframe_fingerprint(loaded) == dataframe_fingerprint(saved)
@@ -0,0 +1,37 @@
+import math
+
+import numpy as np
+import pytest
+from sklearn.metrics import average_precision_score, roc_auc_score
+
+from evaluate import roc_pr_curves, sweep_thresholds
+
+
+def test_curves_match_scikit_learn():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 2, 500)
+    # Rounded so that many rows tie.
+    probabilities = np.round(np.clip(labels * 0.3 + rng.random(500) * 0.7, 0, 1), 2)
+
+    curves, roc_auc, average_precision = roc_pr_curves(probabilities, labels)
+
+    assert roc_auc == pytest.approx(roc_auc_score(labels, probabilities))
+    assert average_precision == pytest.approx(average_precision_score(labels, probabilities))
+    assert len(curves) == len(np.unique(probabilities))
+
+
+def test_curves_of_no_rows_are_empty():
+    curves, roc_auc, average_precision = roc_pr_curves(np.array([]), np.array([], dtype=np.int64))
+
+    assert curves.empty
+    assert math.isnan(roc_auc) and math.isnan(average_precision)
+
+
+def test_threshold_sweep_counts_the_confusion_matrix_exactly():
+    probabilities = np.array([0.1, 0.4, 0.6, 0.9, 0.5])
+    labels = np.array([0, 1, 0, 1, 1])
+
+    sweep = sweep_thresholds(probabilities, labels, np.array([0.5]))
+
+    assert sweep[["tp", "fp", "tn", "fn"]].iloc[0].tolist() == [1, 1, 1, 2]
+    assert sweep["accuracy"].iloc[0] == pytest.approx(0.4)
@@ -0,0 +1,53 @@
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = Registry()
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1)))
+    for value in [0.05, 0.5, 0.5, 5]:
+        latency.observe(value, path="/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{path="/a",le="0.1"} 1',
+        'latency_seconds_bucket{path="/a",le="1"} 3',
+        'latency_seconds_bucket{path="/a",le="+Inf"} 4',
+        'latency_seconds_sum{path="/a"} 6.05',
+        'latency_seconds_count{path="/a"} 4',
+    ]
+
+
+def test_gauges_and_counters_are_read_at_scrape_time():
+    registry = Registry()
+    depths = {"batcher": 1}
+    registry.register(Gauge("queue_depth", "Queued texts.", lambda: depths, label="queue"))
+    registry.register(Counter("coalesced_total", "Coalesced requests.", lambda: 7))
+    depths["batcher"] = 3
+
+    assert registry.render().splitlines()[2:] == [
+        'queue_depth{queue="batcher"} 3',
+        "# HELP coalesced_total Coalesced requests.",
+        "# TYPE coalesced_total counter",
+        "coalesced_total 7",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.register(Gauge("odd", "Odd labels.", lambda: {'a"b\\c\nd': 1}, label="name"))
+
+    assert registry.render().splitlines()[-1] == 'odd{name="a\\"b\\\\c\\nd"} 1'
+
+
+def test_drained_values_merge_into_another_registry():
+    worker, server = Registry(), Registry()
+    for registry in [worker, server]:
+        registry.register(Histogram("batch_size", "Batch sizes.", buckets=(1, 8)))
+
+    worker.metrics["batch_size"].observe(4)
+    server.metrics["batch_size"].observe(1)
+    server.merge(worker.drain())
+
+    assert 'batch_size_count 2' in server.render().splitlines()
+    assert worker.drain() == {"batch_size": {}}
@@ -0,0 +1,61 @@
+import pytest
+import torch
+from transformers import (
+    AlbertConfig,
+    AlbertForMaskedLM,
+    BertConfig,
+    BertForMaskedLM,
+    BertTokenizerFast,
+    DistilBertConfig,
+    DistilBertForMaskedLM,
+    RobertaConfig,
+    RobertaForMaskedLM,
+)
+
+from preprocessor import Preprocessor
+
+WORDS = ["he", "is", "has", "would", "had", "gone", "home", "i", "said"]
+SIZES = dict(vocab_size=len(WORDS) + 5)
+
+MODELS = {
+    "bert": lambda: BertForMaskedLM(BertConfig(
+        **SIZES, hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32
+    )),
+    "roberta": lambda: RobertaForMaskedLM(RobertaConfig(
+        **SIZES, hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32, pad_token_id=0
+    )),
+    "albert": lambda: AlbertForMaskedLM(AlbertConfig(
+        **SIZES, embedding_size=8, hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32
+    )),
+    "distilbert": lambda: DistilBertForMaskedLM(DistilBertConfig(
+        **SIZES, dim=16, n_layers=1, n_heads=2, hidden_dim=32
+    )),
+}
+
+
+@pytest.fixture
+def tokenizer(tmp_path):
+    path = tmp_path / "vocab.txt"
+    path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n")
+    return BertTokenizerFast(vocab_file=str(path))
+
+
+@pytest.mark.parametrize("model_type", MODELS)
+def test_local_scoring_works_with_any_masked_lm(tokenizer, model_type):
+    torch.manual_seed(0)
+    preprocessor = Preprocessor(scoring="local", context_window=2)
+    preprocessor._tokenizer, preprocessor._model = tokenizer, MODELS[model_type]().eval()
+
+    candidates = [["i", "said", "he", "is", "gone", "home"], ["i", "said", "he", "has", "gone", "home"]]
+    scores = preprocessor.score_local_options(candidates, [3, 3])
+
+    # The same scores, computed with a full forward pass over every position.
+    expected = []
+    for words in candidates:
+        input_ids = tokenizer.encode(" ".join(["said", "he", "[MASK]", "gone", "home"]), return_tensors="pt")
+        position = input_ids[0].tolist().index(tokenizer.mask_token_id)
+        with torch.no_grad():
+            log_probs = torch.log_softmax(preprocessor.model(input_ids=input_ids).logits[0, position], dim=-1)
+        expected.append(log_probs[tokenizer.convert_tokens_to_ids(words[3])].item())
+
+    assert scores == pytest.approx(expected, abs=1e-5)
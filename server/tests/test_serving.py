@@ -0,0 +1,41 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from flask import Flask
+
+from serving import run_production
+
+
+def test_production_server_handles_requests_concurrently():
+    app = Flask(__name__)
+
+    @app.route("/slow")
+    def slow():
+        time.sleep(0.5)
+        return "done"
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    threading.Thread(target=run_production, args=(app, "127.0.0.1", port, 8), daemon=True).start()
+
+    url = f"http://127.0.0.1:{port}/slow"
+    for _ in range(100):
+        try:
+            urlopen(url, timeout=5).read()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda _: urlopen(url, timeout=5).read(), range(4)))
+    elapsed = time.perf_counter() - start
+
+    # Served one at a time, four requests would take 2 seconds.
+    assert responses == [b"done"] * 4
+    assert elapsed < 1.2
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import sweep
+from sweep import first_epoch_pruner, grid_trials, load_space, random_trials, run_trial, trial_args
+
+
+def test_grid_tries_every_combination():
+    trials = grid_trials({"lr": [1e-5, 2e-5], "batch_size": [16, 32, 64]})
+
+    assert len(trials) == 6
+    assert {(trial["lr"], trial["batch_size"]) for trial in trials} == {
+        (lr, batch_size) for lr in [1e-5, 2e-5] for batch_size in [16, 32, 64]
+    }
+
+
+def test_grid_needs_lists():
+    with pytest.raises(ValueError):
+        grid_trials({"lr": {"low": 1e-5, "high": 1e-3}})
+
+
+def test_random_trials_sample_within_ranges_reproducibly():
+    space = {
+        "lr": {"low": 1e-6, "high": 1e-3, "log": True},
+        "maxlen_train": {"low": 20, "high": 60},
+        "distill_alpha": {"low": 0.1, "high": 0.9},
+        "batch_size": [16, 32],
+    }
+    trials = random_trials(space, 50, seed=1)
+
+    assert trials == random_trials(space, 50, seed=1)
+    assert trials != random_trials(space, 50, seed=2)
+    for trial in trials:
+        assert 1e-6 <= trial["lr"] <= 1e-3
+        assert isinstance(trial["maxlen_train"], int) and 20 <= trial["maxlen_train"] <= 60
+        assert 0.1 <= trial["distill_alpha"] <= 0.9
+        assert trial["batch_size"] in [16, 32]
+
+
+def test_space_only_names_training_arguments(tmp_path):
+    path = tmp_path / "space.json"
+    path.write_text(json.dumps({"lr": [1e-5]}))
+    assert load_space(str(path)) == {"lr": [1e-5]}
+
+    with pytest.raises(ValueError):
+        load_space('{"learning_rate": [1e-5]}')
+
+
+def test_trials_save_to_their_own_directories():
+    trial = trial_args(7, {"lr": 1e-4})
+
+    assert trial.lr == 1e-4
+    assert trial.output_dir.endswith("trial-007")
+    assert not trial.distributed
+
+
+def test_trials_far_below_the_best_first_epoch_are_pruned():
+    first_epoch_accuracies = []
+    first, second, third = (first_epoch_pruner(first_epoch_accuracies, 0.02) for _ in range(3))
+
+    # The first trial has nothing to compare with.
+    assert not first(0, 0.80)
+    assert not second(0, 0.79)
+    assert third(0, 0.70)
+    # Only the first epoch is judged.
+    assert not first(1, 0.10)
+    assert first_epoch_accuracies == [0.80, 0.79, 0.70]
+
+
+def test_pruned_trials_are_reported(monkeypatch):
+    calls = []
+
+    def fake_run_training(trial, split=None, split_path=None, should_stop=None):
+        calls.append((split, split_path, trial.num_threads))
+        accuracy = 0.9 if trial.lr == 1e-4 else 0.5
+        epochs = 1 if should_stop(0, accuracy) else trial.num_eps
+        return {"accuracy": accuracy, "epochs": epochs, "samples_per_sec": 10.0}
+
+    monkeypatch.setattr(sweep, "run_training", fake_run_training)
+    monkeypatch.setattr(sweep.torch, "set_num_threads", lambda num_threads: None)
+    monkeypatch.setattr(sweep.args, "num_eps", 3)
+
+    first_epoch_accuracies = []
+    best = run_trial((0, {"lr": 1e-4}, first_epoch_accuracies, 1, 2, "cache/split"))
+    pruned = run_trial((1, {"lr": 1e-6, "num_threads": 0}, first_epoch_accuracies, 1, 2, "cache/split"))
+
+    assert (best["epochs"], best["stopped_early"]) == (3, False)
+    assert (pruned["epochs"], pruned["stopped_early"]) == (1, True)
+    # Trials read back the split the parent saved, with their share of the DataLoader workers.
+    assert calls == [(None, "cache/split", 2), (None, "cache/split", 0)]
+
+
+def test_failed_trials_are_reported_instead_of_ending_the_sweep(monkeypatch):
+    def fail(trial, split=None, split_path=None, should_stop=None):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(sweep, "run_training", fail)
+    monkeypatch.setattr(sweep.torch, "set_num_threads", lambda num_threads: None)
+
+    row = run_trial((3, {"batch_size": 4096}, [], 1, 0, "cache/split"))
+    assert row["trial"] == 3 and "out of memory" in row["error"]
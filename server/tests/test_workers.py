@@ -0,0 +1,64 @@
+import os
+import threading
+
+import pytest
+
+from workers import InferenceWorkerPool, WorkerError
+
+
+class FakePreprocessor:
+    def load_scoring_model(self):
+        pass
+
+    def disambiguate_batch(self, texts):
+        return [text.lower() for text in texts]
+
+
+class FakeClassifier:
+    backend = "eager"
+
+    def classify_sentiment_batch(self, texts):
+        if "die" in texts:
+            os._exit(1)
+        if "fail" in texts:
+            error = RuntimeError("boom")
+            # Locks can't be pickled, so this error can't be sent back as it is.
+            error.lock = threading.Lock()
+            raise error
+        return [len(text) for text in texts]
+
+
+def make_pool(num_workers):
+    return InferenceWorkerPool(FakePreprocessor(), FakeClassifier(), num_workers, max_wait_ms=0)
+
+
+def test_texts_are_processed_by_the_workers():
+    pool = make_pool(2)
+
+    assert pool.run_many(["A", "Bb", "Ccc"], deadline=None) == [("a", 1), ("bb", 2), ("ccc", 3)]
+    assert pool.queue_depth() == 0
+
+
+def test_unpicklable_errors_reach_the_caller():
+    pool = make_pool(1)
+
+    with pytest.raises(WorkerError, match="boom"):
+        pool.submit("fail").result(timeout=10)
+    assert pool.run("ok") == ("ok", 2)
+
+
+def test_texts_of_a_dead_worker_fail_and_the_others_carry_on():
+    pool = make_pool(2)
+
+    with pytest.raises(WorkerError):
+        pool.submit("die").result(timeout=10)
+    assert pool.run("ok") == ("ok", 2)
+
+
+def test_texts_are_refused_once_every_worker_died():
+    pool = make_pool(1)
+
+    with pytest.raises(WorkerError):
+        pool.submit("die").result(timeout=10)
+    with pytest.raises(WorkerError):
+        pool.submit("ok")
@@ -0,0 +1,22 @@
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Records how long each startup phase takes and prints a breakdown."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        print("=== STARTUP TIMES ===")
+        for name, seconds in self.phases:
+            print(f"{name}: {seconds:.2f}s")
+        print(f"total: {time.perf_counter() - self.start:.2f}s")
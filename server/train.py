@@ -1,62 +1,276 @@
+import argparse
+import gc
+import os
+import time
+import numpy as np
+import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader
 from tqdm import trange
-from sklearn.model_selection import train_test_split
-import pandas as pd
 
-from dataset import ModyDataset
+from dataset import ModyDataset, load_split, make_loader, save_array
 from arguments import args
-from classifier import Classifier
+from classifier import Classifier, DistillationLoss, EarlyExitLoss, is_main_process
+from model import build_reduced_bert, model_fingerprint
+from workers import available_cores
+
+# Joins the process group set up by torchrun and splits the node's cores between its local ranks.
+def init_distributed():
+    dist.init_process_group(backend="gloo")
+    torch.set_num_threads(max(1, available_cores() // int(os.environ["LOCAL_WORLD_SIZE"])))
+
+
+# Loads a trained classifier for inference only, single-process, with the given arguments overridden.
+def load_inference_classifier(args, **overrides):
+    return Classifier(
+        for_training=False,
+        args=argparse.Namespace(**{**vars(args), "inference_backend": "eager", "distributed": False, **overrides}),
+    )
+
+
+def cache_teacher_logits(teacher, train_df, args):
+    """
+    Runs the teacher over the training split once and writes its logits next to its
+    tokenized copy of the split, keyed by the teacher's weights, returning the file's path.
+    Later runs with the same teacher and data reuse the file.
+    """
+    teacher_set = ModyDataset(maxlen=args.maxlen_train, tokenizer=teacher.tokenizer, dataframe=train_df)
+    path = teacher_set.cache_path(f"teacher-{model_fingerprint(teacher.model)}")
+    if os.path.exists(path):
+        print(f"Using cached teacher logits {path}")
+        return path
+
+    save_array(path, teacher.predict_logits(teacher_set, args.batch_size, args.num_threads))
+    return path
+
+
+# Prepares distillation on the main process: builds the reduced-layer student if asked for and caches the teacher's logits.
+def prepare_distillation(train_df, args):
+    teacher = load_inference_classifier(args, model_name_or_path=args.teacher_model_name_or_path)
+
+    if args.student_layers is not None:
+        if teacher.config.model_type != "bert":
+            raise ValueError("--student_layers needs a BERT teacher.")
+
+        student_dir = f"models/{args.output_dir}/"
+        if os.path.exists(os.path.join(student_dir, "config.json")) and not args.overwrite_output_dir:
+            raise ValueError(
+                f"{student_dir} already holds a model. Pick another --output_dir, or pass --overwrite_output_dir to replace it."
+            )
+        print(f"Building a {args.student_layers}-layer student from the teacher in {student_dir}")
+        student = build_reduced_bert(teacher.model, args.student_layers)
+        student.save_pretrained(save_directory=student_dir)
+        teacher.tokenizer.save_pretrained(save_directory=student_dir)
+
+    return cache_teacher_logits(teacher, train_df, args)
+
+
+# Times classify_sentiment on each text, one tweet at a time, returning mean and median milliseconds.
+def measure_latency(classifier, texts):
+    classifier.classify_sentiment(texts[0])
+
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        classifier.classify_sentiment(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return np.mean(latencies), np.median(latencies)
+
+
+# Compares the teacher and the saved student on validation accuracy and per-tweet latency.
+def compare_with_teacher(val_df, args):
+    criterion = nn.BCEWithLogitsLoss()
+    texts = val_df["sentence"].tolist()[:args.latency_samples]
+
+    for name, model_name_or_path in [
+        ("Teacher", args.teacher_model_name_or_path),
+        ("Student", f"models/{args.output_dir}/"),
+    ]:
+        classifier = load_inference_classifier(args, model_name_or_path=model_name_or_path)
+        val_set = ModyDataset(maxlen=args.maxlen_val, tokenizer=classifier.tokenizer, dataframe=val_df)
+        val_accuracy, _ = classifier.evaluate(
+            val_loader=make_loader(val_set, args.batch_size, args.num_threads, bucket_by_length=args.bucket_by_length),
+            criterion=criterion,
+        )
+        mean_ms, median_ms = measure_latency(classifier, texts)
+        print(
+            f"{name} : {classifier.config.model_type}, {sum(p.numel() for p in classifier.model.parameters())} parameters, "
+            f"Validation Accuracy : {val_accuracy}, Latency : {mean_ms:.2f} ms mean, {median_ms:.2f} ms median per tweet"
+        )
+
+
+def run_training(args, split=None, split_path=None, should_stop=None):
+    """
+    Trains a classifier with the given arguments, saving it whenever validation accuracy improves.
+    split is the (train, validation) data frame pair. Without it, the split save_split wrote to
+    split_path is read back, or, without that either, the split is made with load_split.
+    should_stop(epoch, val_accuracy) is asked after every evaluation whether to stop early.
+    Returns the best validation accuracy, the number of epochs run and the mean training throughput (NaN if none ran).
+    """
+    if args.distributed:
+        init_distributed()
+
+    # Load entire dataframe once and split into 80% train, 20% validation
+    train_df, val_df = split if split is not None else load_split(split_path)
+
+    distilling = args.teacher_model_name_or_path is not None
+    soft_labels_path = None
+    if distilling:
+        if is_main_process():
+            soft_labels_path = prepare_distillation(train_df, args)
+        if args.distributed:
+            # The other ranks wait for the student and the teacher's logits, then share their path.
+            shared = [soft_labels_path]
+            dist.broadcast_object_list(shared)
+            soft_labels_path = shared[0]
+        if args.student_layers is not None:
+            args.model_name_or_path = f"models/{args.output_dir}/"
 
-if __name__ == "__main__":
     # Initialize classifier.
     classifier = Classifier(for_training=True, args=args)
 
     # Set citerion, which takes as input logits of positive class and computes binary cross-entropy.
     criterion = nn.BCEWithLogitsLoss()
+    # While distilling, train on a mix of the hard labels and the teacher's soft labels, but still validate on the hard labels.
+    train_criterion = criterion
+    if distilling:
+        train_criterion = DistillationLoss(alpha=args.distill_alpha, temperature=args.distill_temperature)
+    if classifier.early_exit:
+        # Train the heads of every layer at once.
+        train_criterion = EarlyExitLoss(train_criterion)
 
     # Set optimizer to Adam.
     optimizer = optim.Adam(params=classifier.model.parameters(), lr=args.lr)
 
-    # Load entire dataframe once
-    full_df = pd.read_csv("./data/final_preprocessed_data_yidong_devansh.csv", names=["sentence", "label"])
-
-    # Split into 80% train, 20% validation
-    train_df, val_df = train_test_split(full_df, test_size=0.2, random_state=42, stratify=full_df["label"])
-
     # Create datasets using the split dataframes
-    train_set = ModyDataset(maxlen=args.maxlen_train, tokenizer=classifier.tokenizer, dataframe=train_df)
+    train_set = ModyDataset(
+        maxlen=args.maxlen_train, tokenizer=classifier.tokenizer, dataframe=train_df, soft_labels_path=soft_labels_path
+    )
     val_set = ModyDataset(maxlen=args.maxlen_val, tokenizer=classifier.tokenizer, dataframe=val_df)
 
     # Initialize validation set and loader.
-    train_loader = DataLoader(
-        dataset=train_set, batch_size=args.batch_size, num_workers=args.num_threads
+    train_loader = make_loader(
+        train_set, args.batch_size, args.num_threads,
+        bucket_by_length=args.bucket_by_length, shuffle=True, distributed=args.distributed,
     )
-    val_loader = DataLoader(
-        dataset=val_set, batch_size=args.batch_size, num_workers=args.num_threads
+    val_loader = make_loader(
+        val_set, args.batch_size, args.num_threads,
+        bucket_by_length=args.bucket_by_length, distributed=args.distributed,
     )
 
     # Initialize best accuracy.
     best_accuracy = 0
+    throughputs = []
     # Go through epochs.
-    for epoch in trange(args.num_eps, desc="Epoch"):
+    for epoch in trange(args.num_eps, desc="Epoch", disable=not is_main_process()):
+        if hasattr(train_loader.sampler, "set_epoch"):
+            # Reshuffle the distributed shards every epoch.
+            train_loader.sampler.set_epoch(epoch)
+
         # Train classifier for one epoch.
-        classifier.train(
-            train_loader=train_loader, optimizer=optimizer, criterion=criterion
+        train_stats = classifier.train(
+            train_loader=train_loader, optimizer=optimizer, criterion=train_criterion
         )
         # Evaluate classifier; get validation loss and accuracy.
         val_accuracy, val_loss = classifier.evaluate(
             val_loader=val_loader, criterion=criterion
         )
         # Display validation accuracy and loss.
-        print(
-            f"Epoch {epoch} complete! Validation Accuracy : {val_accuracy}, Validation Loss : {val_loss}"
-        )
-        # Save classifier if validation accuracy imporoved.
-        if val_accuracy > best_accuracy:
+        if is_main_process():
+            print(
+                f"Epoch {epoch} complete! Validation Accuracy : {val_accuracy}, Validation Loss : {val_loss}"
+            )
+            if classifier.early_exit:
+                print(
+                    f"Average layers executed : {classifier.average_layers_executed():.2f} of {classifier.config.num_hidden_layers} at exit threshold {args.exit_threshold}"
+                )
             print(
-                f"Best validation accuracy improved from {best_accuracy} to {val_accuracy}, saving classifier..."
+                f"Training throughput : {train_stats['samples_per_sec']:.1f} samples/sec, "
+                f"{train_stats['peak_memory_label']} : {train_stats['peak_memory_mb']:.0f} MB"
             )
+        # Save classifier if validation accuracy imporoved. Every rank sees the same reduced accuracy.
+        if val_accuracy > best_accuracy:
+            if is_main_process():
+                print(
+                    f"Best validation accuracy improved from {best_accuracy} to {val_accuracy}, saving classifier..."
+                )
             best_accuracy = val_accuracy
-            classifier.save()
\ No newline at end of file
+            classifier.save()
+
+        throughputs.append(train_stats["samples_per_sec"])
+
+        if should_stop is not None and should_stop(epoch, val_accuracy):
+            if is_main_process():
+                print(f"Stopping early after epoch {epoch}")
+            break
+
+    # Checked before the process group is destroyed, after which every rank looks like the main one.
+    main_process = is_main_process()
+
+    if args.distributed:
+        # Free the DDP wrapper while the process group is still registered; if its reducer
+        # held the last reference, the group would be torn down under the GIL and could
+        # deadlock with gloo's worker threads.
+        del classifier
+        gc.collect()
+        dist.destroy_process_group()
+
+    if distilling and main_process:
+        compare_with_teacher(val_df, args)
+
+    return {
+        "accuracy": best_accuracy,
+        "epochs": len(throughputs),
+        "samples_per_sec": sum(throughputs) / len(throughputs) if throughputs else float("nan"),
+    }
+
+
+def check_training_parity(args):
+    """
+    Trains the model with the given --bf16, --compile and --grad_accum_steps, then again
+    in plain fp32 into models/<output_dir>-fp32/, from the same seed, and evaluates both
+    saved models on the validation split so their accuracies can be compared.
+    """
+    if not (args.bf16 or args.compile or args.grad_accum_steps > 1):
+        raise ValueError("--check_parity compares against --bf16, --compile or --grad_accum_steps, but none is set.")
+    if args.distributed:
+        raise ValueError("--check_parity trains both models in a single process; drop --distributed.")
+
+    # Copied before training, which may point model_name_or_path at a distilled student.
+    fp32_args = argparse.Namespace(
+        **{**vars(args), "bf16": False, "compile": False, "grad_accum_steps": 1, "output_dir": f"{args.output_dir}-fp32"}
+    )
+
+    split = load_split()
+    for run_args in [args, fp32_args]:
+        torch.manual_seed(0)
+        run_training(run_args, split=split)
+
+    criterion = nn.BCEWithLogitsLoss()
+    _, val_df = split
+
+    accuracies = {}
+    for name, output_dir in [("fp32", fp32_args.output_dir), ("trained", args.output_dir)]:
+        classifier = load_inference_classifier(args, model_name_or_path=f"models/{output_dir}/")
+        val_set = ModyDataset(maxlen=args.maxlen_val, tokenizer=classifier.tokenizer, dataframe=val_df)
+        accuracies[name], val_loss = classifier.evaluate(
+            val_loader=make_loader(val_set, args.batch_size, args.num_threads, bucket_by_length=args.bucket_by_length),
+            criterion=criterion,
+        )
+        print(f"{name} (models/{output_dir}/): Validation Accuracy : {accuracies[name]}, Validation Loss : {val_loss}")
+
+    options = ", ".join(
+        option for option, enabled in [
+            ("bf16", args.bf16), ("compile", args.compile), (f"grad_accum_steps {args.grad_accum_steps}", args.grad_accum_steps > 1)
+        ] if enabled
+    )
+    print(f"Accuracy difference of {options} from fp32: {accuracies['trained'] - accuracies['fp32']:+.4f}")
+
+
+if __name__ == "__main__":
+    if args.check_parity:
+        check_training_parity(args)
+    else:
+        run_training(args)
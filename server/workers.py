@@ -0,0 +1,256 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from operator import itemgetter
+
+import torch
+
+from batcher import Overloaded, DeadlineExceeded, collect_batch, wait_until
+from metrics import REGISTRY
+
+
+class WorkerError(Exception):
+    """Raised for a text whose inference worker failed or died while processing it."""
+
+
+# Number of CPU cores this process may run on.
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Seconds between checks that the inference workers are still alive.
+WORKER_CHECK_INTERVAL = 0.5
+
+
+def worker_main(index, preprocessor, classifier, tasks, results, num_threads, max_batch_size, max_wait):
+    # Split the cores between workers instead of every worker using all of them.
+    torch.set_num_threads(num_threads)
+
+    # Forget the metrics inherited from the parent; only this worker's are sent back.
+    REGISTRY.drain()
+
+    while True:
+        batch, expired = collect_batch(tasks, max_batch_size, max_wait, itemgetter(2))
+        for task_id, _, _ in expired:
+            results.put(("error", task_id, DeadlineExceeded()))
+
+        if not batch:
+            continue
+
+        # Tell the parent which texts this worker holds, so they are failed if it dies.
+        results.put(("claimed", index, [task_id for task_id, _, _ in batch]))
+
+        try:
+            preprocessed_texts = preprocessor.disambiguate_batch([text for _, text, _ in batch])
+            decisions = classifier.classify_sentiment_batch(preprocessed_texts)
+        except Exception as e:
+            # Not every exception can be pickled, so only its description is sent back.
+            for task_id, _, _ in batch:
+                results.put(("error", task_id, WorkerError(repr(e))))
+            continue
+
+        for (task_id, _, _), preprocessed_text, decision in zip(batch, preprocessed_texts, decisions):
+            results.put(("result", task_id, (preprocessed_text, decision)))
+
+        # Send this batch's stage metrics to the parent, which serves /metrics.
+        results.put(("metrics", index, REGISTRY.drain()))
+
+
+# The preprocessor inherited by each preprocessing pool process.
+pool_preprocessor = None
+
+
+def init_preprocess_worker(preprocessor, num_threads):
+    global pool_preprocessor
+    pool_preprocessor = preprocessor
+    torch.set_num_threads(num_threads)
+
+
+def disambiguate_batch(texts):
+    return pool_preprocessor.disambiguate_batch(texts)
+
+
+def preprocess_pool(preprocessor, num_workers):
+    """
+    Forks num_workers processes for bulk contraction disambiguation. The scoring model
+    is loaded first, so every process shares its weights, and the cores are split
+    between the processes.
+    """
+    preprocessor.load_scoring_model()
+
+    return multiprocessing.get_context("fork").Pool(
+        num_workers,
+        initializer=init_preprocess_worker,
+        initargs=(preprocessor, max(1, available_cores() // num_workers)),
+    )
+
+
+# Disambiguates cleaned texts in the pool in batches; .get() on the result returns one list per batch.
+def disambiguate_async(pool, cleaned_texts, batch_size):
+    batches = [cleaned_texts[i:i + batch_size] for i in range(0, len(cleaned_texts), batch_size)]
+    return pool.map_async(disambiguate_batch, batches)
+
+
+class InferenceWorkerPool:
+    """
+    Runs contraction disambiguation and classification in forked worker processes.
+
+    The preprocessor's MLM and the classifier are loaded once in the parent and the
+    workers are forked afterwards, so every worker reads the same weight pages
+    (copy-on-write; inference never writes to them) instead of holding its own copy.
+    Texts go onto one shared queue that idle workers pull micro-batches from, which
+    balances load across workers. Each worker gets an equal share of the cores for
+    torch's intra-op threads.
+
+    The pool must be created before the parent starts other threads or runs a
+    forward pass, since only the forking thread survives in the children. For the
+    same reason a worker that dies is not replaced: the texts it held fail with
+    WorkerError, the others carry on, and once every worker is gone new texts are
+    refused with WorkerError.
+    """
+
+    def __init__(self, preprocessor, classifier, num_workers, max_batch_size=32, max_wait_ms=5, max_queue_size=256):
+        if classifier.backend == "onnx":
+            raise ValueError("The worker pool shares PyTorch weights; use the eager or int8 backend.")
+
+        # Load the lazily-loaded scoring model now so the workers share it too.
+        preprocessor.load_scoring_model()
+
+        self.num_workers = num_workers
+        self.threads_per_worker = max(1, available_cores() // num_workers)
+
+        context = multiprocessing.get_context("fork")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+
+        self.workers = [
+            context.Process(
+                target=worker_main,
+                args=(
+                    i,
+                    preprocessor,
+                    classifier,
+                    self.tasks,
+                    self.results,
+                    self.threads_per_worker,
+                    max_batch_size,
+                    max_wait_ms / 1000,
+                ),
+                name=f"inference-worker-{i}",
+                daemon=True,
+            )
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        print(f"Started {num_workers} inference workers with {self.threads_per_worker} threads each")
+
+        self.task_ids = itertools.count()
+        self.futures = {}
+        # Worker index for every text a worker has taken off the task queue.
+        self.claims = {}
+        self.dead = set()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_queue_size + num_workers * max_batch_size)
+
+        # Resolve futures as the workers report back.
+        self.collector = threading.Thread(
+            target=self._collect_results, name="worker-results", daemon=True
+        )
+        self.collector.start()
+
+        # Fail the texts of workers that die, instead of leaving their requests waiting forever.
+        self.monitor = threading.Thread(
+            target=self._monitor_workers, name="worker-monitor", daemon=True
+        )
+        self.monitor.start()
+
+    # Queues a cleaned text and returns a future resolving to (preprocessed text, decision).
+    def submit(self, cleaned_text, deadline=None):
+        if len(self.dead) == len(self.workers):
+            raise WorkerError("Every inference worker has died.")
+
+        if not self.slots.acquire(blocking=False):
+            raise Overloaded()
+
+        future = Future()
+        with self.lock:
+            task_id = next(self.task_ids)
+            self.futures[task_id] = future
+
+        self.tasks.put((task_id, cleaned_text, deadline))
+        return future
+
+    # Preprocesses and classifies a cleaned text in a worker, waiting until the deadline.
+    def run(self, cleaned_text, deadline=None):
+        return wait_until(self.submit(cleaned_text, deadline), deadline)
+
+    # Same for several texts, which the workers can pick up in parallel.
+    def run_many(self, cleaned_texts, deadline=None):
+        futures = [self.submit(text, deadline) for text in cleaned_texts]
+        return [wait_until(future, deadline) for future in futures]
+
+    # Number of texts queued for or being processed by the workers.
+    def queue_depth(self):
+        with self.lock:
+            return len(self.futures)
+
+    def _collect_results(self):
+        while True:
+            kind, key, payload = self.results.get()
+
+            if kind == "metrics":
+                REGISTRY.merge(payload)
+            elif kind == "claimed":
+                with self.lock:
+                    for task_id in payload:
+                        if task_id in self.futures:
+                            self.claims[task_id] = key
+            elif kind == "error":
+                self._resolve(key, error=payload)
+            else:
+                self._resolve(key, result=payload)
+
+    # Resolves a text's future, unless it was already failed when its worker died.
+    def _resolve(self, task_id, result=None, error=None):
+        with self.lock:
+            future = self.futures.pop(task_id, None)
+            self.claims.pop(task_id, None)
+        if future is None:
+            return
+        self.slots.release()
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _monitor_workers(self):
+        while True:
+            time.sleep(WORKER_CHECK_INTERVAL)
+
+            died = {
+                index for index, worker in enumerate(self.workers)
+                if index not in self.dead and not worker.is_alive()
+            }
+            if not died:
+                continue
+
+            with self.lock:
+                self.dead |= died
+                # A worker may die between taking texts off the queue and claiming them, so
+                # unclaimed texts are failed too. Any of them still queued is ignored when done.
+                failed = [
+                    task_id for task_id in self.futures
+                    if task_id not in self.claims or self.claims[task_id] in died
+                ]
+
+            print(f"Inference workers {sorted(died)} died, failing {len(failed)} texts")
+            for task_id in failed:
+                self._resolve(task_id, error=WorkerError("An inference worker died while this text was queued or running."))